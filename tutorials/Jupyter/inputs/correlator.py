@@ -0,0 +1,266 @@
+"""Multi-tau streaming correlator
+
+The autocorrelation function of a time series is estimated as the
+observations arrive, without storing the series (Ramirez et al.,
+J. Chem. Phys. 133, 154103 (2010)). The correlator has a number of
+levels. Level 0 correlates the raw series at lags 0, ..., p - 1.
+Level k correlates averages of m^k consecutive values at lags
+j m^k with p/m <= j < p. The lags therefore span many decades, and
+only O(levels * p) values are held.
+
+Observations may be added one at a time, or in blocks. They are
+buffered and processed a block at a time with array operations.
+Several observables may be correlated together (one channel each).
+
+The correlator may be registered with ObservableData (see
+ObservableData.add_correlator()) to provide autocorrelation_time()
+for an observable whose series has not been kept; the sum is then
+windowed automatically (windowed_time()).
+"""
+
+import numpy
+
+class MultiTauCorrelator(object):
+
+    """Online multi-tau estimate of the autocorrelation function"""
+
+    def __init__(self, nobs = None, nlevel = 20, p = 16, m = 2,
+                 nbuffer = 1024, dt = 1):
+
+        """
+        Arguments:
+        nobs (integer):     number of channels; None for a single
+                            scalar series
+        nlevel (integer):   number of levels
+        p (integer):        lags per level
+        m (integer):        averaging factor between levels
+        nbuffer (integer):  observations buffered before processing
+        dt (integer):       time between observations
+        """
+
+        if p % m != 0: raise ValueError("p must be a multiple of m")
+        if m < 2: raise ValueError("Please use m >= 2")
+
+        self.nobs = nobs
+        self.nlevel = nlevel
+        self.p = p
+        self.m = m
+        self.nbuffer = nbuffer
+        self.dt = dt
+
+        nchan = 1 if nobs is None else nobs
+
+        self.n = 0
+        self._shift = None
+        self._sum = numpy.zeros(nchan)
+        self._sumsq = numpy.zeros(nchan)
+        self._buffer = []
+        self._nbuffer = 0
+
+        self._history = [numpy.zeros((0, nchan)) for _ in range(nlevel)]
+        self._pending = [numpy.zeros((0, nchan)) for _ in range(nlevel)]
+        self._products = numpy.zeros((nlevel, p, nchan))
+        self._counts = numpy.zeros((nlevel, p), dtype = numpy.int64)
+
+
+    def __repr__(self):
+
+        me = "nobs= {!r}, nlevel= {!r}, p= {!r}, m= {!r}, n= {!r}"\
+            .format(self.nobs, self.nlevel, self.p, self.m, self.n)
+
+        return "MultiTauCorrelator({!s})".format(me)
+
+
+    def add(self, values):
+
+        """
+        Add one observation, or a block of observations
+
+        Arguments:
+        values:  for a scalar series, a number or an array (nblock);
+                 otherwise an array (nobs) or (nblock, nobs)
+        """
+
+        x = numpy.asarray(values, dtype = float)
+        nchan = self._sum.size
+
+        if self.nobs is None:
+            x = x.reshape(-1, 1)
+        else:
+            x = x.reshape(-1, nchan)
+
+        if self._shift is None and x.shape[0] > 0:
+            self._shift = x[0].copy()
+
+        self._buffer.append(x)
+        self._nbuffer += x.shape[0]
+        if self._nbuffer >= self.nbuffer:
+            self.flush()
+
+
+    def flush(self):
+
+        """Process any buffered observations"""
+
+        if not self._buffer: return
+
+        x = numpy.concatenate(self._buffer) - self._shift
+        self._buffer = []
+        self._nbuffer = 0
+
+        self.n += x.shape[0]
+        self._sum += numpy.sum(x, axis = 0)
+        self._sumsq += numpy.sum(x*x, axis = 0)
+
+        self._process(0, x)
+
+
+    def lags(self):
+
+        """Return the lags (in units of dt) with at least one product"""
+
+        lags, _, _ = self._table()
+
+        return self.dt*lags
+
+
+    def mean(self):
+
+        """Return the mean of the observations"""
+
+        self.flush()
+        if self.n == 0: return numpy.nan
+
+        mean = self._sum/self.n + self._shift
+
+        return mean[0] if self.nobs is None else mean
+
+
+    def autocorrelation(self):
+
+        """
+        Return the lags and the normalised autocorrelation function
+        phi(t) = (<a(0) a(t)> - <a>^2)/(<a^2> - <a>^2)
+
+        Returns:
+        lags (numpy.ndarray):   lags in units of dt (nlag)
+        phi (numpy.ndarray):    (nlag) for a scalar series, otherwise
+                                (nobs, nlag)
+        """
+
+        lags, phi, _ = self._table()
+
+        return self.dt*lags, (phi[:, 0] if self.nobs is None else phi.T)
+
+
+    def integrated_time(self, tmax):
+
+        """
+        Return sum_{0 < t < tmax} phi(t) (in units of dt), each lag
+        being weighted by the spacing of lags at its level
+
+        Arguments:
+        tmax (integer):   upper limit of the sum, in units of dt
+        """
+
+        lags, phi, width = self._table()
+        use = (lags > 0) & (lags < tmax/self.dt)
+
+        ta = numpy.sum(phi[use]*width[use, numpy.newaxis], axis = 0)
+
+        return ta[0] if self.nobs is None else ta
+
+
+    def windowed_time(self, c = 5.0, tmax = None):
+
+        """
+        Return the integrated time (in units of dt) with Sokal's
+        automatic window: the sum of integrated_time() is taken to
+        the first lag M >= c (1/2 + sum) (see util.integrated_time()),
+        or to the last lag below tmax (in units of dt) if sooner
+
+        Returns:
+        tau:       integrated time, for each channel
+        window:    lag M at which the sum stops, for each channel
+        """
+
+        lags, phi, width = self._table()
+        use = lags > 0
+        if tmax is not None: use &= lags < tmax/self.dt
+        lags = lags[use]
+
+        tau = numpy.cumsum(numpy.nan_to_num(phi[use])
+                           *width[use, numpy.newaxis], axis = 0)
+        ok = lags[:, numpy.newaxis] >= c*(0.5 + tau)
+        last = numpy.where(numpy.any(ok, axis = 0),
+                           numpy.argmax(ok, axis = 0), lags.size - 1)
+
+        ta = self.dt*tau[last, numpy.arange(tau.shape[1])]
+        window = self.dt*lags[last]
+
+        if self.nobs is None: return ta[0], window[0]
+
+        return ta, window
+
+
+    def _table(self):
+
+        """Return lags, phi (nlag, nchan) and lag spacing (nlag)"""
+
+        self.flush()
+
+        n = max(self.n, 1)
+        mean = self._sum/n
+        var = self._sumsq/n - mean*mean
+
+        lags = []
+        rows = []
+        width = []
+
+        for k in range(self.nlevel):
+            j0 = 0 if k == 0 else self.p//self.m
+            for j in range(j0, self.p):
+                count = self._counts[k, j]
+                if count == 0: continue
+                lags.append(j*self.m**k)
+                rows.append(self._products[k, j]/count)
+                width.append(self.m**k)
+
+        lags = numpy.array(lags, dtype = numpy.int64)
+        rows = numpy.array(rows).reshape(-1, mean.size)
+
+        with numpy.errstate(invalid = "ignore", divide = "ignore"):
+            phi = (rows - mean*mean)/var
+
+        return lags, phi, numpy.array(width, dtype = float)
+
+
+    def _process(self, k, x):
+
+        """Correlate a block x (nblock, nchan) at level k"""
+
+        p = self.p
+        z = numpy.concatenate([self._history[k], x])
+        nz = z.shape[0]
+        start = self._history[k].shape[0]
+
+        j0 = 0 if k == 0 else p//self.m
+        for j in range(j0, p):
+            t0 = max(start, j)
+            if t0 >= nz: break
+            self._products[k, j] += numpy.sum(z[t0:]*z[t0 - j:nz - j], axis = 0)
+            self._counts[k, j] += nz - t0
+
+        self._history[k] = z[-(p - 1):] if p > 1 else z[0:0]
+
+        if k + 1 >= self.nlevel: return
+
+        # Averages of m consecutive values go to the next level
+
+        acc = numpy.concatenate([self._pending[k], x])
+        nfull = (acc.shape[0]//self.m)*self.m
+        self._pending[k] = acc[nfull:]
+
+        if nfull > 0:
+            y = acc[:nfull].reshape(-1, self.m, acc.shape[1]).mean(axis = 1)
+            self._process(k + 1, y)
@@ -0,0 +1,456 @@
+"""Single histogram reweighting
+
+Ferrenberg and Swendsen (Phys. Rev. Lett. 61, 2635 (1988)) single
+histogram reweighting of observations made at one value of a
+parameter to another value of that parameter.
+
+If the Boltzmann weight depends on the parameter p only through a
+term exp(alpha p x) for some observable x (e.g., exp(-beta V e) for
+inverse temperature beta and energy per site e), then the average
+of an observable A at a new value p' is
+
+  <A>_p' = sum_n A_n exp(alpha (p' - p) x_n) / sum_n exp(alpha (p' - p) x_n)
+
+over the observations n at p. The exponents are normalised by
+log-sum-exp, so large values do not overflow, and any number of
+new parameter values are computed in one pass. The sums are taken
+over the distinct values of x (see util.compress()), so the cost
+depends on the number of levels rather than the number of
+observations.
+
+Reweighter         reweighting with respect to a general parameter
+BetaReweighter     reweighting with respect to inverse temperature
+KTReweighter       reweighting with respect to temperature kT
+ReweightEstimator  reweighted averages for block resampling
+PeakLocator        maximum of a reweighted response (e.g., C_V(kT))
+"""
+
+import numpy
+
+import inputs.util as util
+import inputs.resample
+
+class Reweighter(object):
+
+    """Reweighting via the weight exp(alpha (p' - p) x)"""
+
+    def __init__(self, rid, param, alpha, obs, binwidth = None):
+
+        """
+        Arguments:
+        rid (string):         identifier, e.g., "h"
+        param (Parameter):    the value p at which data were taken
+        alpha (Parameter):    the multiplier alpha
+        obs (Observable):     the conjugate observable x
+        binwidth (float):     bin x (default: exact distinct values)
+        """
+
+        self._rid = rid.lower()
+        self.param = param
+        self.alpha = alpha
+        self.obs = obs
+        self.binwidth = binwidth
+        self._levels = None
+
+
+    def __repr__(self):
+
+        me = "rid= {!r}, param= {!r}, alpha= {!r}, obs= {!r}"\
+            .format(self._rid, self.param, self.alpha, self.obs.id())
+
+        return "{!s}({!s})".format(type(self).__name__, me)
+
+
+    def rid(self):
+
+        """Return the identifier"""
+
+        return self._rid
+
+
+    def levels(self):
+
+        """
+        Return the compressed form of the conjugate observable:
+        distinct values, counts, and the level of each observation
+        """
+
+        if self._levels is None or self._levels[2].size != self.obs.data.size:
+            self._levels = util.compress(self.obs.data, None, self.binwidth)
+
+        return self._levels
+
+
+    def coordinate(self, p):
+
+        """Return the coordinate in which the weight is linear"""
+
+        return p
+
+
+    def delta(self, pnew):
+
+        """Return alpha (p' - p) in the coordinate of the weight"""
+
+        return float(self.alpha)*(self.coordinate(pnew)
+                                  - self.coordinate(float(self.param)))
+
+
+    def log_weights(self, pnew):
+
+        """
+        Return the normalised log weights of each level at the new
+        parameter value(s)
+
+        Arguments:
+        pnew (float or numpy.ndarray):  new parameter value(s)
+
+        Returns:
+        logw (numpy.ndarray):  (ntarget, nlevel) for the levels of
+                               levels(); exp(logw) sums to one along
+                               the second axis
+        """
+
+        pnew = numpy.atleast_1d(numpy.asarray(pnew, dtype = float))
+        x, count, _ = self.levels()
+
+        delta = self.delta(pnew)
+        logw = numpy.outer(delta, x) + numpy.log(count)
+        logw -= util.log_sum_exp(logw, axis = 1)[:, numpy.newaxis]
+
+        return logw
+
+
+    def log_partition_ratio(self, pnew):
+
+        """Return ln Z(p')/Z(p) estimated from the data"""
+
+        pnew = numpy.asarray(pnew, dtype = float)
+        x, count, index = self.levels()
+
+        delta = self.delta(numpy.atleast_1d(pnew))
+        r = util.log_sum_exp(numpy.outer(delta, x) + numpy.log(count),
+                             axis = 1) - numpy.log(index.size)
+
+        return r[0] if pnew.ndim == 0 else r
+
+
+    def reweight_obs(self, obs, pnew):
+
+        """
+        Reweight an observable to new parameter value(s)
+
+        Arguments:
+        obs (numpy.ndarray):  observations (nsample) or (nsample, nobs)
+        pnew (float or numpy.ndarray):  new parameter value(s)
+
+        Returns:
+        The reweighted average: a float for a single observable and a
+        scalar pnew; otherwise an array (ntarget), (nobs) or
+        (ntarget, nobs) as appropriate
+        """
+
+        obs = numpy.asarray(obs, dtype = float)
+        assert obs.shape[0] == numpy.size(self.obs.data), "Check obs data"
+
+        # Mean of the observable at each level
+        _, count, index = self.levels()
+        mean = util.level_sums(index, count.size, obs)
+        mean = (mean.T/count).T
+
+        robs = numpy.dot(numpy.exp(self.log_weights(pnew)), mean)
+
+        if numpy.ndim(pnew) == 0:
+            robs = robs[0]
+
+        return robs
+
+
+class BetaReweighter(Reweighter):
+
+    """Reweighting with respect to inverse temperature beta
+
+    The weight is exp(-(beta' - beta) V e) for energy per site e
+    and volume V (number of sites).
+    """
+
+    def __init__(self, rid, beta, volume, obs, binwidth = None):
+
+        """
+        Arguments:
+        rid (string):          identifier, e.g., "beta"
+        beta (Parameter):      inverse temperature of the data
+        volume (Parameter):    system volume
+        obs (Observable):      energy per unit volume
+        binwidth (float):      bin energies (default: distinct values)
+        """
+
+        super(BetaReweighter, self).__init__(rid, beta, -float(volume),
+                                             obs, binwidth)
+        self.volume = volume
+
+
+class KTReweighter(Reweighter):
+
+    """Reweighting with respect to temperature kT
+
+    As BetaReweighter, but with new temperatures kT' = 1/beta'.
+    """
+
+    def __init__(self, rid, kt, volume, obs, binwidth = None):
+
+        """
+        Arguments:
+        rid (string):          identifier, e.g., "kt"
+        kt (Parameter):        temperature of the data
+        volume (Parameter):    system volume
+        obs (Observable):      energy per unit volume
+        binwidth (float):      bin energies (default: distinct values)
+        """
+
+        super(KTReweighter, self).__init__(rid, kt, -float(volume),
+                                           obs, binwidth)
+        self.volume = volume
+
+
+    def coordinate(self, p):
+
+        return 1.0/p
+
+
+class ReweightEstimator(object):
+
+    """Reweighted averages as an estimator for block resampling
+
+    The observables are summed at each level of the reweighter in
+    each of nblock consecutive blocks of the series. A resample with
+    block multiplicities w then has level sums w . sums, and a batch
+    of resamples is reweighted to all the new parameter values at
+    once (see inputs.resample).
+    """
+
+    def __init__(self, reweighter, obs, pnew, nblock = 10,
+                 response = None):
+
+        """
+        Arguments:
+        reweighter (Reweighter):  reweighting in the parameter
+        obs (numpy.ndarray):      observations (nsample) or (nsample, nobs)
+        pnew (numpy.ndarray):     new parameter values (ntarget)
+        nblock (integer):         number of blocks
+        response (callable):      optional response(pnew, averages)
+                                  of averages (..., ntarget, nobs)
+        """
+
+        self.reweighter = reweighter
+        self.pnew = numpy.atleast_1d(numpy.asarray(pnew, dtype = float))
+        self.nblock = nblock
+        self.response = response
+
+        self._counts, self._sums = _block_levels(reweighter, obs, nblock)
+
+
+    def __call__(self, weights):
+
+        """
+        Return the reweighted averages (nbatch, ntarget, nobs), or
+        the response (nbatch, ...), for block multiplicities weights
+        (nbatch, nblock)
+        """
+
+        count = numpy.dot(weights, self._counts)
+        total = numpy.tensordot(weights, self._sums, axes = 1)
+
+        # Weights (nbatch, ntarget, nlevel), normalised by the largest
+        # over the levels occupied in each resample
+
+        x = self.reweighter.levels()[0]
+        g = numpy.outer(self.reweighter.delta(self.pnew), x)[numpy.newaxis]
+        occupied = (count > 0)[:, numpy.newaxis, :]
+        gmax = numpy.max(numpy.where(occupied, g, -numpy.inf), axis = 2,
+                         keepdims = True)
+        w = numpy.where(occupied, numpy.exp(numpy.minimum(g - gmax, 0.0)),
+                        0.0)
+
+        averages = numpy.matmul(w, total)\
+            /numpy.matmul(w, count[:, :, numpy.newaxis])
+
+        if self.response is None:
+            return averages
+
+        return self.response(self.pnew, averages)
+
+
+class PeakLocator(object):
+
+    """Locate the maximum of a response function of reweighted averages
+
+    The response (e.g., C_V or the susceptibility as a function of
+    kT) is a function of the reweighted averages of a few observables.
+    The observables are summed at each level of the reweighter once,
+    in each of nblock consecutive blocks of the series, so that each
+    evaluation of the response at a new parameter value is a single
+    weighted sum over levels. The maximum is located by Brent's
+    method, and its error is estimated by jackknife or bootstrap
+    over the blocks (see inputs.resample).
+    """
+
+    def __init__(self, reweighter, obs, response, nblock = 10):
+
+        """
+        Arguments:
+        reweighter (Reweighter):  reweighting in the parameter
+        obs (numpy.ndarray):      observations (nsample, nobs)
+        response (callable):      response(p, averages) where the
+                                  averages have shape (nobs)
+        nblock (integer):         number of blocks for resampling
+        """
+
+        self.reweighter = reweighter
+        self.response = response
+        self.nblock = nblock
+
+        self._counts, self._sums = _block_levels(reweighter, obs, nblock)
+
+
+    def __repr__(self):
+
+        me = "reweighter= {!r}, nblock= {!r}"\
+            .format(self.reweighter.rid(), self.nblock)
+
+        return "PeakLocator({!s})".format(me)
+
+
+    def averages(self, pnew, weights = None):
+
+        """
+        Return the reweighted averages (nobs) at pnew, from all the
+        data, or from the blocks with multiplicities weights (nblock)
+        """
+
+        if weights is None: weights = numpy.ones(self.nblock)
+
+        count = numpy.dot(weights, self._counts)
+        total = numpy.tensordot(weights, self._sums, axes = 1)
+
+        # Unoccupied levels (in a resample) get zero weight, rather
+        # than exp() of a possibly large exponent
+
+        x = self.reweighter.levels()[0]
+        g = self.reweighter.delta(float(pnew))*x
+        occupied = count > 0
+        w = numpy.zeros_like(g)
+        w[occupied] = numpy.exp(g[occupied] - numpy.max(g[occupied]))
+
+        return numpy.dot(w, total)/numpy.dot(w, count)
+
+
+    def value(self, pnew, weights = None):
+
+        """Return the response at pnew (optionally for a resample)"""
+
+        return self.response(pnew, self.averages(pnew, weights))
+
+
+    def locate(self, bracket, ngrid = 16, tol = 1.0e-8, method = "jackknife",
+               nresample = 200, seed = None, processes = 1):
+
+        """
+        Locate the maximum of the response in the interval bracket
+
+        The response is first evaluated on a grid of ngrid points,
+        and the maximum is refined by Brent's method between the
+        neighbours of the best grid point. The same is done for each
+        resample of the blocks for the error.
+
+        Arguments:
+        bracket (tuple):       the interval
+        method (string):       "jackknife" or "bootstrap"
+        nresample (integer):   number of bootstrap resamples
+        seed (integer):        bootstrap random seed
+        processes (integer):   number of processes for resampling
+
+        Returns:
+        peak (dict):  "location", "height", "location_error",
+                      "height_error"
+        """
+
+        estimator = PeakEstimator(self, bracket, ngrid, tol)
+
+        if method == "jackknife":
+            result = inputs.resample.jackknife(estimator, self.nblock,
+                                               processes = processes)
+        elif method == "bootstrap":
+            result = inputs.resample.bootstrap(estimator, self.nblock,
+                                               nresample, seed,
+                                               processes = processes)
+        else:
+            raise ValueError("Unknown method {!r}".format(method))
+
+        peak = {}
+        peak["location"] = result["estimate"][0]
+        peak["height"] = result["estimate"][1]
+        peak["location_error"] = result["error"][0]
+        peak["height_error"] = result["error"][1]
+
+        return peak
+
+
+    def _locate(self, bracket, ngrid, tol, weights):
+
+        grid = numpy.linspace(bracket[0], bracket[1], ngrid)
+        values = [self.value(p, weights) for p in grid]
+        n = int(numpy.argmax(values))
+
+        a = grid[max(n - 1, 0)]
+        b = grid[min(n + 1, ngrid - 1)]
+        func = lambda p: self.value(p, weights)
+
+        x, fx, _ = util.brent_maximise(func, a, b, grid[n], tol)
+
+        return x, fx
+
+
+class PeakEstimator(object):
+
+    """The peak of a PeakLocator as an estimator for resampling"""
+
+    def __init__(self, locator, bracket, ngrid = 16, tol = 1.0e-8):
+
+        self.locator = locator
+        self.bracket = bracket
+        self.ngrid = ngrid
+        self.tol = tol
+
+
+    def __call__(self, weights):
+
+        """Return (location, height) for each resample (nbatch, 2)"""
+
+        return numpy.array([self.locator._locate(self.bracket, self.ngrid,
+                                                 self.tol, w)
+                            for w in weights])
+
+
+def _block_levels(reweighter, obs, nblock):
+
+    """
+    Return the counts (nblock, nlevel) and sums of observations
+    (nblock, nlevel, nobs) in each block at each level
+    """
+
+    obs = numpy.asarray(obs, dtype = float)
+    obs = obs.reshape(obs.shape[0], -1)
+
+    x, _, index = reweighter.levels()
+    assert obs.shape[0] == index.size, "Check obs data"
+
+    nlevel = x.size
+    cell = inputs.resample.block_index(index.size, nblock)*nlevel + index
+
+    counts = numpy.bincount(cell, minlength = nblock*nlevel)\
+                  .reshape(nblock, nlevel).astype(float)
+    sums = util.level_sums(cell, nblock*nlevel, obs)\
+               .reshape(nblock, nlevel, obs.shape[1])
+
+    return counts, sums
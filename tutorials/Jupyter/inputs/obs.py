@@ -23,6 +23,8 @@ class ObservableData(object):
         self.params = OrderedDict()
         self.observables = []
         self.reweighters = []
+        self.correlators = OrderedDict()
+        self._times = {}
         self.independent_variable = None
 
         self.data_source = ""
@@ -163,6 +165,23 @@ class ObservableData(object):
         self.reweighters.append(re)
 
 
+    def add_correlator(self, key, correlator, channel=None):
+
+        """Register a streaming correlator for an observable
+
+        autocorrelation_time(key) then uses the correlator (see
+        inputs.correlator.MultiTauCorrelator) rather than the data,
+        which need not be kept.
+
+        Arguments:
+        key (string):               observable key
+        correlator:                 correlator fed with the series
+        channel (integer):          channel of a multi-channel correlator
+        """
+
+        self.correlators[key.lower()] = (correlator, channel)
+
+
     def summary_time_series(self, pyplot, key, t0=0, t1=-1):
 
         """
@@ -266,6 +285,78 @@ class ObservableData(object):
         pyplot.show()
 
 
+    def detect_equilibration(self, keys=None, ncandidate=100, nsigma=0.0):
+
+        """
+        Suggested equilibration (burn-in) cut for each observable
+
+        The whole of each series (including any part already
+        discarded) is scanned together (see util.detect_equilibration()).
+
+        Arguments:
+        keys (list of string):   observable keys (default all except
+                                 the independent variable)
+        ncandidate (integer):    number of candidate cut points
+        nsigma (float):          a later cut must improve the effective
+                                 number of samples by more than nsigma
+                                 standard errors
+
+        Returns:
+        cuts (OrderedDict):      for each key, a dict with "index" (of
+                                 the first equilibrated measurement),
+                                 "t0" (its time), "g" (statistical
+                                 inefficiency after the cut) and "neff"
+                                 (effective number of samples)
+        """
+
+        if keys is None:
+            keys = [obs.id() for obs in self.observables]
+
+        time = self.independent_variable.all_data()
+        data = numpy.stack([self.observable(key).all_data() for key in keys])
+        index, g, neff = util.detect_equilibration(data, ncandidate,
+                                                   nsigma=nsigma)
+
+        cuts = OrderedDict()
+        for n, key in enumerate(keys):
+            cuts[key] = {"index": int(index[n]), "t0": time[index[n]],
+                         "g": float(g[n]), "neff": float(neff[n])}
+
+        return cuts
+
+
+    def equilibrate(self, index=None, keys=None, ncandidate=100, nsigma=0.0):
+
+        """
+        Discard the equilibration part of all the series
+
+        The same cut is applied to every observable (and the
+        independent variable), so the series stay aligned; the data
+        become views of the remaining measurements. By default the
+        cut is the latest of those suggested by detect_equilibration()
+        for the given keys.
+
+        Arguments:
+        index (integer):         number of measurements to discard
+                                 (0 restores all the data)
+        keys, ncandidate, nsigma:  see detect_equilibration()
+
+        Returns:
+        index (integer):         the number of measurements discarded
+        """
+
+        if index is None:
+            cuts = self.detect_equilibration(keys, ncandidate, nsigma)
+            index = max(cut["index"] for cut in cuts.values())
+
+        self.independent_variable.discard(index)
+        for obs in self.observables:
+            obs.discard(index)
+        self._times.clear()
+
+        return index
+
+
     def _pyplot_figure_info(self, figure, observable=None):
 
         x0 = 0.95
@@ -330,24 +421,114 @@ class ObservableData(object):
 
         """
         Compute the autocorrelation time for an obsevaable
+
+        This is sum_{t > 0} phi(t) with the automatic window of
+        integrated_times(). If a correlator has been registered for
+        the observable (see add_correlator()) it is used instead of
+        the data.
+
+        Arguments:
+        key (string):        observable key
+        nmaxlag (integer):   largest window, in measurements (for a
+                             correlator, in units of its dt)
+
+        Returns:
+        (dt, tau):   time between measurements, autocorrelation time
         """
 
-        obs = self.observable(key)
+        if key.lower() in self.correlators:
+            correlator, channel = self.correlators[key.lower()]
+            ta, _ = correlator.windowed_time(tmax=correlator.dt*nmaxlag)
+            if channel is not None: ta = ta[channel]
+            return (correlator.dt, ta)
+
+        times = self.integrated_times([key], nmaxlag=nmaxlag)
 
-        # phi(t) can become negative, or bumpy, as t becomes large.
-        # To get a reasonable figure for the autocorrelation time,
-        # we progressively increase the upper limit of the discrete
-        # sum.
+        return (self.dt(), times[key]["tau"])
+
+
+    def integrated_times(self, keys=None, c=5.0, nmaxlag=None):
+
+        """
+        Integrated autocorrelation times with their errors
+
+        The autocorrelation functions of all the observables not
+        already computed are found together by FFT, and the sums are
+        windowed automatically (see util.integrated_time()). Results
+        are cached per observable, and recomputed if its data object
+        is replaced (data changed in place are not detected).
+
+        Arguments:
+        keys (list of string):   observable keys (default all except
+                                 the independent variable)
+        c (float):               window factor
+        nmaxlag (integer):       largest window (default half the series)
+
+        Returns:
+        times (OrderedDict):     for each key, a dict with "tau" and
+                                 "error" (in units of time), "window"
+                                 (in units of time) and "g" (statistical
+                                 inefficiency 1 + 2 tau/dt)
+        """
+
+        if keys is None:
+            keys = [obs.id() for obs in self.observables]
+
+        # The cache holds the data each result was computed from, so a
+        # replaced (or re-cut) series is recomputed
 
         dt = self.dt()
-        phi = util.autocorrelation(obs.data, nmaxlag)
+        data = dict((key, self.observable(key).data) for key in keys)
+        tags = dict((key, (key.lower(), c, nmaxlag)) for key in keys)
+
+        missing = [key for key in keys
+                   if self._times.get(tags[key], (None,))[0] is not data[key]]
+        if missing:
+            series = numpy.stack([data[key] for key in missing])
+            tau, error, window = util.integrated_time(series, c, nmaxlag)
+            for n, key in enumerate(missing):
+                self._times[tags[key]] = \
+                    (data[key], (tau[n], error[n], window[n]))
+
+        times = OrderedDict()
+        for key in keys:
+            tau, error, window = self._times[tags[key]][1]
+            times[key] = {"tau": float(dt*tau), "error": float(dt*error),
+                          "window": int(dt*window),
+                          "g": float(1.0 + 2.0*tau)}
+
+        return times
+
+
+    def blocking_errors(self, keys=None, nminblock=32, method="plateau"):
+
+        """
+        Standard errors of the means of observables by blocking
+
+        All the observables (default all except the independent
+        variable) are blocked together as one 2D array (see
+        util.blocking_error()).
+
+        Arguments:
+        keys (list of string):   observable keys
+        nminblock (integer):     minimum number of blocks
+        method (string):         "plateau" or "max"
+
+        Returns:
+        errors (OrderedDict):    for each key, a dict with "mean",
+                                 "error" (standard error of the mean)
+                                 and "g" (statistical inefficiency)
+        """
+
+        if keys is None:
+            keys = [obs.id() for obs in self.observables]
+
+        data = numpy.stack([self.observable(key).data for key in keys])
+        mean = numpy.mean(data, axis=-1)
+        stderr, g = util.blocking_error(data, nminblock, method)
 
-        ta0 = 0.0
-        nt = 1
-        while nt < nmaxlag:
-            ta = numpy.sum(phi[1:nt])
-            if ta < ta0: break
-            ta0 = ta
-            nt *= 2
+        errors = OrderedDict()
+        for n, key in enumerate(keys):
+            errors[key] = {"mean": mean[n], "error": stderr[n], "g": g[n]}
 
-        return (dt, dt*ta0)
+        return errors
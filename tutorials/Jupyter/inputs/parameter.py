@@ -36,7 +36,7 @@ class ParameterInt(int):
 
         """Return string including the label"""
 
-        parameter = "value= {!s}, label= {!r}".format(self, self.label)
+        parameter = "value= {!s}, label= {!r}".format(int(self), self.label)
 
         return "ParameterInt({!s})".format(parameter)
 
@@ -69,7 +69,7 @@ class ParameterFloat(float):
 
         """Return a string including the label"""
 
-        parameter = "value= {!s}, label= {!r}".format(self, self.label)
+        parameter = "value= {!s}, label= {!r}".format(float(self), self.label)
 
         return "ParameterFloat({!s})".format(parameter)
 
@@ -0,0 +1,179 @@
+"""Block bootstrap and jackknife resampling
+
+Resampling of a correlated time series is done in blocks: the
+series is cut into nblock consecutive blocks, and a resample is
+described by the multiplicity of each block (a row of a weight
+matrix of shape (nresample, nblock)). For the block bootstrap the
+multiplicities are multinomial (blocks drawn with replacement);
+for the jackknife the rows are ones with one block left out.
+
+An estimator is any callable estimator(weights) which takes a
+weight matrix (nbatch, nblock) and returns an array (nbatch, ...),
+one estimate per resample. Estimators which have summed their data
+in each block beforehand (see, e.g., histogram.ReweightEstimator)
+evaluate a batch of resamples with a few matrix products.
+
+Batches of resamples may be distributed over a pool of processes.
+Each bootstrap batch draws its multiplicities from its own random
+stream (numpy.random.SeedSequence.spawn()), so the result depends
+on the seed but not on the number of processes.
+
+bootstrap()          block bootstrap estimate and standard error
+jackknife()          block jackknife estimate and standard error
+bootstrap_weights()  multiplicities for block bootstrap resamples
+jackknife_weights()  multiplicities for block jackknife resamples
+block_index()        block of each observation in a series
+"""
+
+import os
+import concurrent.futures
+
+import numpy
+
+def block_index(nsample, nblock):
+
+    """Return the block (0, ..., nblock - 1) of each of nsample values"""
+
+    if nblock < 2 or nblock > nsample:
+        raise ValueError("Please use 2 <= nblock <= nsample")
+
+    return (numpy.arange(nsample)*nblock)//nsample
+
+
+def bootstrap_weights(nblock, nresample, rng, strata = None):
+
+    """
+    Return block multiplicities for bootstrap resamples
+
+    Arguments:
+    nblock (integer):          number of blocks
+    nresample (integer):       number of resamples
+    rng (numpy.random.Generator):  random stream
+    strata (numpy.ndarray):    optional group of each block; blocks
+                               are then drawn within each group
+                               (e.g., separately for each run)
+
+    Returns:
+    weights (numpy.ndarray):   (nresample, nblock)
+    """
+
+    if strata is None:
+        strata = numpy.zeros(nblock, dtype = int)
+
+    strata = numpy.asarray(strata)
+    weights = numpy.zeros((nresample, nblock))
+
+    for group in numpy.unique(strata):
+        members = numpy.nonzero(strata == group)[0]
+        p = numpy.full(members.size, 1.0/members.size)
+        weights[:, members] = rng.multinomial(members.size, p,
+                                              size = nresample)
+
+    return weights
+
+
+def jackknife_weights(nblock):
+
+    """Return block multiplicities (nblock, nblock) for the jackknife"""
+
+    return 1.0 - numpy.eye(nblock)
+
+
+def bootstrap(estimator, nblock, nresample = 200, seed = None, batch = 25,
+              processes = None, strata = None):
+
+    """
+    Block bootstrap estimate and standard error
+
+    Arguments:
+    estimator (callable):   estimator(weights) -> (nbatch, ...)
+    nblock (integer):       number of blocks
+    nresample (integer):    number of resamples
+    seed (integer):         seed for the random streams
+    batch (integer):        resamples per batch
+    processes (integer):    number of processes; None for one per
+                            CPU, and 1 to run in this process
+    strata (numpy.ndarray): group of each block (see bootstrap_weights)
+
+    Returns:
+    result (dict):  "estimate" (from all the data), "error"
+                    (standard deviation of the resamples), and
+                    "samples" (nresample, ...)
+    """
+
+    sizes = [min(batch, nresample - n) for n in range(0, nresample, batch)]
+    streams = numpy.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(estimator, nblock, size, stream, strata)
+            for size, stream in zip(sizes, streams)]
+
+    samples = numpy.concatenate(_map(_bootstrap_batch, jobs, processes))
+
+    result = {}
+    result["estimate"] = estimator(numpy.ones((1, nblock)))[0]
+    result["error"] = numpy.std(samples, axis = 0, ddof = 1)
+    result["samples"] = samples
+
+    return result
+
+
+def jackknife(estimator, nblock, batch = 25, processes = 1):
+
+    """
+    Block jackknife estimate and standard error
+
+    Arguments:
+    estimator (callable):   estimator(weights) -> (nbatch, ...)
+    nblock (integer):       number of blocks
+    batch (integer):        resamples per batch
+    processes (integer):    number of processes (see bootstrap())
+
+    Returns:
+    result (dict):  "estimate" (from all the data), "error"
+                    (jackknife standard error), and "samples"
+                    (nblock, ...) with block i left out of sample i
+    """
+
+    weights = jackknife_weights(nblock)
+    jobs = [(estimator, weights[n:n + batch])
+            for n in range(0, nblock, batch)]
+
+    samples = numpy.concatenate(_map(_evaluate_batch, jobs, processes))
+    deviation = samples - numpy.mean(samples, axis = 0)
+    scale = (nblock - 1.0)/nblock
+
+    result = {}
+    result["estimate"] = estimator(numpy.ones((1, nblock)))[0]
+    result["error"] = numpy.sqrt(scale*numpy.sum(deviation**2, axis = 0))
+    result["samples"] = samples
+
+    return result
+
+
+def _bootstrap_batch(estimator, nblock, nresample, stream, strata):
+
+    rng = numpy.random.default_rng(stream)
+    weights = bootstrap_weights(nblock, nresample, rng, strata)
+
+    return numpy.asarray(estimator(weights))
+
+
+def _evaluate_batch(estimator, weights):
+
+    return numpy.asarray(estimator(weights))
+
+
+def _map(function, jobs, processes):
+
+    """Return [function(*job) for job in jobs], using a process pool"""
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    processes = min(processes, len(jobs))
+
+    if processes <= 1:
+        return [function(*job) for job in jobs]
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(function, *job) for job in jobs]
+        return [future.result() for future in futures]
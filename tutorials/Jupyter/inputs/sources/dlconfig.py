@@ -3,8 +3,10 @@
 This is simple enough that one class is defined to take all
 the content (including molcules/atoms).
 
-TODO. Atoms are only stored as strings; a more structured
-format could be imagined.
+By default, atoms are stored as strings. Alternatively, a
+structured form may be requested, in which each molecule holds
+an array of atom types "types" and an (natom, 3) array of
+positions "coords" in place of the strings "atoms".
 
 A module level convenience methof from_file() is supplied
 as a factory method.
@@ -78,8 +80,14 @@ class CONFIG(object):
             lines.append("MOLECULE {} {} {}"\
                          .format(mol["name"], mol["natom"], mol["nmaxatom"]))
 
-            for line in mol["atoms"]:
-                lines.append(line)
+            if "atoms" in mol:
+                for line in mol["atoms"]:
+                    lines.append(line)
+            else:
+                fmt = "{:20.10f}{:20.10f}{:20.10f}"
+                for atype, r in zip(mol["types"], mol["coords"]):
+                    lines.append(atype)
+                    lines.append(fmt.format(r[0], r[1], r[2]))
 
         return "\n".join(lines)
 
@@ -130,18 +138,18 @@ class CONFIG(object):
 
 
     @classmethod
-    def from_file(cls, filename, dlfield=None):
+    def from_file(cls, filename, dlfield=None, structured=False):
 
         """Return an instance from file"""
 
         lines = dlutil.load_ascii(filename)
-        config = CONFIG.from_dlstr("\n".join(lines), dlfield)
+        config = CONFIG.from_dlstr("\n".join(lines), dlfield, structured)
 
         return config
 
 
     @classmethod
-    def from_dlstr(cls, dlstr, dlfield=None):
+    def from_dlstr(cls, dlstr, dlfield=None, structured=False):
 
         """Generate instance from content of DL CONFIG file.
 
@@ -150,6 +158,8 @@ class CONFIG(object):
         dlstr (string):          the content
         dlfield (FIELD):         If present, the content can be checked
                                  against the field description
+        structured (boolean):    If True, atoms are stored as arrays
+                                 "types" and "coords"
 
         Returns: new instance of CONFIG
         """
@@ -216,13 +226,19 @@ class CONFIG(object):
             except (IndexError, ValueError):
                 raise ValueError("Could not parse MOLECULE: {!r}|".format(line))
 
-            atoms = []
-            for n in range(mol["natom"]):
-                # The atoms are just the string descriptions
-                atoms.append(lines.pop(0))
-                atoms.append(lines.pop(0))
-
-            mol.update({"atoms": atoms})
+            # The atoms are just the string descriptions
+            natom = mol["natom"]
+            atoms = lines[:2*natom]
+            del lines[:2*natom]
+
+            if structured:
+                types = numpy.array(atoms[0::2])
+                coords = numpy.array(" ".join(atoms[1::2]).split(),
+                                     dtype=float).reshape(natom, 3)
+                mol.update({"types": types})
+                mol.update({"coords": coords})
+            else:
+                mol.update({"atoms": atoms})
             molecules.append(mol)
 
 
@@ -240,8 +256,8 @@ class CONFIG(object):
         return CONFIG(title, level, dlformat, vcell, nummol, molecules)
 
 
-def from_file(filename, dlfield=None):
+def from_file(filename, dlfield=None, structured=False):
 
     """A convenience method to generate a config"""
 
-    return CONFIG.from_file(filename, dlfield)
+    return CONFIG.from_file(filename, dlfield, structured)
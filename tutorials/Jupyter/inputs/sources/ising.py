@@ -1,9 +1,26 @@
 """A two-dimensional Ising Model implementation"""
 
 import sys
+import asyncio
+import threading
 import numpy
 import numpy.random
 
+import inputs.util as util
+import inputs.sources.isingevents as isingevents
+import inputs.sources.isinginstrument as isinginstrument
+
+# Batches of records from IsingModel.run_iter()
+RECORD_DTYPE = numpy.dtype([("step", int), ("s", float), ("m", float),
+                            ("naccept", int)])
+
+# Coupling stencils {(di, dj): K} give the coupling j*K to the spin
+# at offset (di, dj); they must be symmetric under (di, dj) -> -(di, dj).
+NEAREST_NEIGHBOUR = {(1, 0): 1.0, (-1, 0): 1.0, (0, 1): 1.0, (0, -1): 1.0}
+
+# Stencils with more entries than this use FFT for the local field
+FFT_THRESHOLD = 16
+
 class IsingModel(object):
 
     r"""
@@ -19,14 +36,20 @@ class IsingModel(object):
 
     This is two dimensions: \sum_ij is over four nearest neighbours.
     The boundaries are periodic.
+
+    More generally, a coupling stencil gives relative couplings K_d
+    for spins at offset d, and S = (1/2) \sum_i \sum_d K_d s_i s_i+d
+    (e.g., next-nearest neighbour J1-J2 or ANNNI models).
     """
 
-    def __init__(self, nlen, j, h, kT, seed, init = 'hot'):
+    def __init__(self, nlen, j, h, kT, seed, init = 'hot',
+                 stencil = None):
 
         """
         A square system of nlen by nlen is created with parameters
         j and h, and temperature kT. A random number seed is
-        supplied to numpy.random().
+        supplied to numpy.random(). The stencil (default nearest
+        neighbour) is a dict {(di, dj): K} of relative couplings.
         """
 
         if numpy.mod(nlen, 2): raise ValueError("Please use even nlen")
@@ -35,7 +58,13 @@ class IsingModel(object):
         self.j = j
         self.h = h
         self.kT = kT
-        self.s = numpy.ndarray((nlen, nlen), dtype = numpy.int)
+        self.stencil = NEAREST_NEIGHBOUR
+        self._colouring = None
+        if stencil is not None and dict(stencil) != NEAREST_NEIGHBOUR:
+            check_stencil(stencil, nlen)
+            self.stencil = dict(stencil)
+            self._colouring = stencil_colouring(self.stencil, nlen)
+        self.s = numpy.ndarray((nlen, nlen), dtype = int)
         self.seed = seed
         numpy.random.seed(seed)
         self.init(init)
@@ -71,57 +100,382 @@ class IsingModel(object):
 
 
     def run(self, nsteps, file = None, report_freq = 1, ndiscard = 0,
-            random_update = False):
+            random_update = False, events = None, keyframe_freq = 100,
+            instrument = None, correlator = None):
 
         """
         Run a number of MC steps and produce some information
+
+        If events is a file name, the sites changed in every sweep
+        are logged there with a keyframe every keyframe_freq sweeps
+        (see isingevents.EventReader to replay the trajectory).
+
+        If instrument is an isinginstrument.Instrument (or True for
+        a default one), the wall time of each phase of the run and
+        the acceptance rates are recorded, and the summary dict is
+        returned (see Instrument.summary()).
+
+        If correlator is given (a two-channel MultiTauCorrelator from
+        inputs.correlator), each report (S, M) is added to it.
         """
 
-        n = 0
+        if correlator is not None and correlator.nobs != 2:
+            raise ValueError("Correlator must have two channels (S, M)")
+
+        if instrument is True: instrument = isinginstrument.Instrument()
+
+        self._report_open(file)
+
+        log = None
+        if events is not None:
+            log = isingevents.EventWriter(events, self.nlen, keyframe_freq)
+            log.record(0, self.s)
+
+        try:
+            clock = None if instrument is None else instrument.clock
+            for n, s, m, _ in self._run_iter(nsteps, report_freq, ndiscard,
+                                             random_update, log = log,
+                                             instrument = instrument):
+                if clock is not None: t0 = clock()
+                self._report_update(n, [s, m])
+                if correlator is not None: correlator.add((s, m))
+                if clock is not None: instrument.report(n, clock() - t0)
+        finally:
+            if log is not None: log.close()
+
+        self._report_close()
+
+        if instrument is not None: return instrument.summary()
+
+
+    def run_adaptive(self, target, keys = ("s", "m"), nmin = 1000,
+                     nmax = 1000000, file = None, report_freq = 1,
+                     random_update = False):
+
+        """
+        Run until the standard error of the mean of each observable
+        falls below a target, and produce some information.
+
+        At intervals (growing geometrically with the number of
+        samples) the start of the equilibrated region is chosen from
+        a set of candidate cut points as that which maximises the
+        number of effectively independent samples (the smallest over
+        keys), and the standard error and statistical inefficiency of
+        the remaining samples are estimated by blocking.
+
+        Arguments:
+        target (float or dict) -- target standard error (per key)
+        keys (sequence)        -- observables, from 's' and 'm'
+        nmin (integer)         -- minimum number of MC steps
+        nmax (integer)         -- maximum number of MC steps
+
+        Returns:
+        summary (dict)         -- 'nsteps' steps used, 'ndiscard'
+                                  equilibration steps discarded,
+                                  'converged', and per key 'mean',
+                                  'error' and 'tau' (in MC steps)
+        """
+
+        if not isinstance(target, dict):
+            target = dict((key, target) for key in keys)
+
         self._report_open(file)
 
+        data = {'s' : [], 'm' : []}
+        nstep = []
+        ncheck = max(nmin//report_freq, 64)
+        result = None
+
+        for n, s, m, _ in self.run_iter(nmax, report_freq,
+                                        random_update = random_update):
+            self._report_update(n, [s, m])
+            nstep.append(n)
+            data['s'].append(s)
+            data['m'].append(m)
+
+            if len(nstep) >= ncheck:
+                result = self._adaptive_check(data, keys)
+                if all(result['error'][k] <= target[k] for k in keys):
+                    break
+                ncheck = int(1.25*ncheck) + 1
+
+        if result is None or len(nstep) > result['nrecord']:
+            result = self._adaptive_check(data, keys)
+
+        # Averages are those of the equilibrated region only
+
+        t0 = result['t0']
+        self.ncount = len(nstep) - t0
+        for k in data:
+            x = numpy.array(data[k][t0:])
+            self.av[k] = numpy.sum(x)
+            self.sq[k] = numpy.sum(x*x)
+
+        self._report_close()
+
+        summary = {}
+        summary['nsteps'] = nstep[-1] if nstep else 0
+        summary['ndiscard'] = nstep[t0] - report_freq if nstep else 0
+        summary['converged'] = \
+            all(result['error'][k] <= target[k] for k in keys)
+        summary['mean'] = result['mean']
+        summary['error'] = result['error']
+        summary['tau'] = dict((k, 0.5*(result['g'][k] - 1.0)*report_freq)
+                              for k in keys)
+
+        return summary
+
+
+    @staticmethod
+    def _adaptive_check(data, keys,
+                        fractions = (0.0, 0.03125, 0.0625, 0.125, 0.25,
+                                     0.5)):
+
+        nrecord = len(data[keys[0]])
+        best = None
+
+        if nrecord < 2:
+            # Too few records for an error estimate; not converged
+            result = {'nrecord' : nrecord, 't0' : 0}
+            result['mean'] = dict((k, numpy.mean(data[k]) if nrecord
+                                   else numpy.nan) for k in keys)
+            result['error'] = dict((k, numpy.inf) for k in keys)
+            result['g'] = dict((k, numpy.nan) for k in keys)
+            return result
+
+        for f in fractions:
+            t0 = int(f*nrecord)
+            if nrecord - t0 < 2: continue
+            neff = None
+            stats = {}
+            for k in keys:
+                x = numpy.array(data[k][t0:])
+                stats[k] = util.blocking_error(x)
+                nk = x.size/stats[k][1]
+                neff = nk if neff is None else min(neff, nk)
+            if best is None or neff > best[0]:
+                best = (neff, t0, stats)
+
+        _, t0, stats = best
+
+        result = {'nrecord' : nrecord, 't0' : t0}
+        result['mean'] = dict((k, numpy.mean(data[k][t0:])) for k in keys)
+        result['error'] = dict((k, stats[k][0]) for k in keys)
+        result['g'] = dict((k, stats[k][1]) for k in keys)
+
+        return result
+
+
+    def run_iter(self, nsteps, report_freq = 1, ndiscard = 0,
+                 random_update = False, batch = None):
+
+        """
+        Run a number of MC steps, yielding the observables as the
+        simulation proceeds.
+
+        Records (step, S, M, naccept) are produced at the same steps
+        as run() would report them; naccept is the number of accepted
+        moves since the previous record. Nothing is written to file
+        and av/sq are not updated.
+
+        Arguments:
+        batch (integer) -- if None, yield each record as a tuple;
+                           otherwise, yield numpy arrays (RECORD_DTYPE)
+                           of up to batch records
+        """
+
+        records = self._run_iter(nsteps, report_freq, ndiscard,
+                                 random_update)
+
+        if batch is None:
+            for record in records:
+                yield record
+            return
+
+        buf = []
+        for record in records:
+            buf.append(record)
+            if len(buf) == batch:
+                yield numpy.array(buf, dtype = RECORD_DTYPE)
+                buf = []
+
+        if buf:
+            yield numpy.array(buf, dtype = RECORD_DTYPE)
+
+
+    async def run_async(self, nsteps, report_freq = 1, ndiscard = 0,
+                        random_update = False, batch = None,
+                        executor = None):
+
+        """
+        Asynchronous form of run_iter() for use with asyncio.
+
+        The sweeps are run in an executor (default: the loop's
+        default executor), so the event loop is not blocked. If
+        the consumer is cancelled, or stops iterating, the run
+        stops at the end of the current sweep.
+
+        Usage:
+        async for (n, s, m, naccept) in model.run_async(nsteps): ...
+        """
+
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+        records = self._run_iter(nsteps, report_freq, ndiscard,
+                                 random_update, stop)
+
+        buf = []
+        done = object()
+
+        try:
+            while True:
+                record = await loop.run_in_executor(executor, next, records,
+                                                    done)
+                if record is done:
+                    break
+                if batch is None:
+                    yield record
+                    continue
+                buf.append(record)
+                if len(buf) == batch:
+                    yield numpy.array(buf, dtype = RECORD_DTYPE)
+                    buf = []
+
+            if buf:
+                yield numpy.array(buf, dtype = RECORD_DTYPE)
+
+        finally:
+            stop.set()
+
+
+    def _run_iter(self, nsteps, report_freq, ndiscard, random_update,
+                  stop = None, log = None, instrument = None):
+
+        """
+        Yield (n, S, M, naccept) at each report after ndiscard sweeps
+
+        If instrument is given, the sweeps, event logging and
+        observables are timed (the caller times its own reporting),
+        and instrument.stop() is called when the loop finishes.
+        """
+
+        n = 0
+        naccept = 0
+
+        if instrument is not None:
+            clock = instrument.clock
+            instrument.start(self.nlen*self.nlen, ndiscard)
+
+        # The clock is read again after each instrument call, so time
+        # spent in any callback is not counted in the next phase
+
         while n < nsteps:
 
+            if stop is not None and stop.is_set(): break
+
             n += 1
-            self._monte_carlo_sweep(random_update)
+            if instrument is not None: t0 = clock()
+            nacc, _ = self._monte_carlo_sweep(random_update)
+            naccept += nacc
+            if instrument is not None: instrument.sweep(n, nacc, clock() - t0)
+
+            if log is not None:
+                if instrument is not None: t0 = clock()
+                log.record(n, self.s)
+                if instrument is not None: instrument.events(n, clock() - t0)
 
             if n > ndiscard and numpy.mod(n, report_freq) == 0:
-                self._report_update(n)
+                if instrument is not None: t0 = clock()
+                [s, m] = self.observables()
+                if instrument is not None:
+                    instrument.observables(n, clock() - t0)
+                yield (n, s, m, naccept)
+                naccept = 0
 
-        self._report_close()
+        if instrument is not None: instrument.stop()
 
 
-    def observables(self):
+    def hysteresis(self, fields, nsweeps = 1, kT = None):
+
         """
-        Return current observable values S, M. These are normalised
-        by the system size (ie., average per site). Recall tat the
-        total energy is - J S - mu H M (with mu = 1).
+        Ramp the external field through a schedule, recording the
+        observables after each field point (an M(h) loop).
+
+        A batch of replicas, each starting from the current state,
+        is run at once on a stacked lattice array with the checker-
+        board update. Replicas may differ in ramp rate (number of
+        sweeps per field point) and/or temperature; nsweeps and kT
+        are broadcast against each other to give the batch. The
+        state of the model itself is not changed.
+
+        Arguments:
+        fields (numpy.ndarray) -- the field schedule (see field_schedule)
+        nsweeps (int or array) -- sweeps per field point (per replica)
+        kT (float or array)    -- temperature (per replica); default
+                                  is the model temperature
+
+        Returns:
+        s (numpy.ndarray)      -- S (nreplica, len(fields))
+        m (numpy.ndarray)      -- M (nreplica, len(fields))
         """
 
-        nlen = self.nlen
-        s = 0.0
-        m = 0.0
+        if kT is None: kT = self.kT
 
-        for ic in range(nlen):
-            im = numpy.mod(ic - 1 + nlen, nlen)
-            ip = numpy.mod(ic + 1, nlen)
-            assert im >= 0 and im < nlen
-            assert ip >= 0 and ip < nlen
+        fields = numpy.asarray(fields, dtype = float)
+        nsweeps, kT = numpy.broadcast_arrays(numpy.atleast_1d(nsweeps),
+                                             numpy.atleast_1d(kT))
+        nsweeps = nsweeps.astype(int)
+        kT = kT.astype(float)
 
-            for jc in range(nlen):
-                jm = numpy.mod(jc - 1 + nlen, nlen)
-                jp = numpy.mod(jc + 1, nlen)
-                assert jm >= 0 and jm < nlen
-                assert jp >= 0 and jp < nlen
+        if numpy.any(nsweeps < 1): raise ValueError("Please use nsweeps >= 1")
 
-                s0 = self.s[ic, jc]
+        # Replicas are held longest ramp first, so those still active
+        # are always a leading slice (a view) of the lattice array
+
+        order = numpy.argsort(-nsweeps, kind = "stable")
+        nsweeps = nsweeps[order]
+        kT = kT[order]
+
+        nrep = nsweeps.size
+        nfield = fields.size
+        lattice = numpy.repeat(self.s[numpy.newaxis, :, :], nrep, axis = 0)
+
+        srec = numpy.zeros((nrep, nfield))
+        mrec = numpy.zeros((nrep, nfield))
+
+        for t in range(nsweeps[0]*nfield):
+
+            point = t//nsweeps
+            nactive = numpy.count_nonzero(point < nfield)
+            h = fields[point[:nactive]]
+
+            sub = lattice[:nactive]
+            if self._colouring is None:
+                checkerboard_sweep(sub, self.j, h, kT[:nactive])
+            else:
+                stencil_sweep(sub, self.stencil, self.j, h, kT[:nactive],
+                              self._colouring)
+
+            done = numpy.nonzero(numpy.mod(t + 1, nsweeps[:nactive]) == 0)[0]
+            if done.size > 0:
+                s, m = lattice_observables(lattice[done], self.stencil)
+                srec[done, point[done]] = s
+                mrec[done, point[done]] = m
+
+        srec[order] = srec.copy()
+        mrec[order] = mrec.copy()
 
-                s += 0.5*s0*(self.s[im, jc] + self.s[ip, jc] + self.s[ic, jm] + self.s[ic, jp])
-                m += s0
+        return srec, mrec
 
-        # Compute averge per site
-        s = s/(nlen*nlen)
-        m = m/(nlen*nlen)
+
+    def observables(self):
+        """
+        Return current observable values S, M. These are normalised
+        by the system size (ie., average per site). Recall tat the
+        total energy is - J S - mu H M (with mu = 1).
+        """
+
+        s, m = lattice_observables(self.s, self.stencil)
 
         return [s, m]
 
@@ -133,24 +487,29 @@ class IsingModel(object):
 
         If you want detailed balance, use a random update; for
         general use, ordered update gives shorter correlation
-        times and so is quicker.
+        times and so is quicker. The random update is the
+        vectorised random_sequential_sweep().
         """
 
+        if self._colouring is not None:
+            if random_update:
+                raise ValueError("Random update requires nearest neighbours")
+            return self._stencil_sweep()
+
+        if random_update:
+            return random_sequential_sweep(self.s, self.j, self.h, self.kT)
+
         nlen = self.nlen
         j = self.j
         h = self.h
         de = 0.0
         naccept = 0
 
-        for i0 in range(nlen):
-            ic = i0
-            if random_update: ic = numpy.random.randint(nlen)
+        for ic in range(nlen):
             im = numpy.mod(ic - 1 + nlen, nlen)
             ip = numpy.mod(ic + 1, nlen)
 
-            for j0 in range(nlen):
-                jc = j0
-                if random_update: jc = numpy.random.randint(nlen)
+            for jc in range(nlen):
                 jm = numpy.mod(jc - 1 + nlen, nlen)
                 jp = numpy.mod(jc + 1, nlen)
 
@@ -179,6 +538,36 @@ class IsingModel(object):
         return naccept, de
 
 
+    def _checkerboard_sweep(self):
+
+        """
+        Single MC sweep of two half-sweeps, each updating one
+        sublattice of the checkerboard (all at once). Returns the
+        number of accepted moves and the energy change.
+        """
+
+        if self._colouring is not None: return self._stencil_sweep()
+
+        naccept, de = checkerboard_sweep(self.s, self.j, self.h, self.kT,
+                                         energy = True)
+
+        return int(naccept), float(de)
+
+
+    def _stencil_sweep(self):
+
+        """
+        Single MC sweep for a general coupling stencil: each colour
+        of the stencil colouring is updated in turn, all at once.
+        Returns the number of accepted moves and the energy change.
+        """
+
+        naccept, de = stencil_sweep(self.s, self.stencil, self.j, self.h,
+                                    self.kT, self._colouring, energy = True)
+
+        return int(naccept), float(de)
+
+
     def _report_open(self, filename):
 
         self.av = {'s' : 0.0, 'm' : 0.0}
@@ -199,9 +588,9 @@ class IsingModel(object):
         f.write("Observable : M magnetization\n")
         self._file = f
 
-    def _report_update(self, nt):
+    def _report_update(self, nt, obs = None):
 
-        [s, m] = self.observables()
+        [s, m] = self.observables() if obs is None else obs
 
         self.ncount += 1
         self.av['s'] += s
@@ -236,3 +625,385 @@ class IsingModel(object):
 
         if self.verbose:
             sys.stdout.write("Wrote results to {:s}\n".format(file))
+
+
+def checkerboard_sweep(s, j, h, kT, energy = False):
+
+    """
+    Metropolis sweep of one or more lattices by checkerboard update.
+
+    The two sublattices (ic + jc even and odd) are updated in turn;
+    sites on one sublattice do not interact, so each half-sweep is
+    performed for all its sites at once.
+
+    Arguments:
+    s (numpy.ndarray)   -- spins (..., nlen, nlen), updated in place
+    j (float)           -- coupling constant
+    h (float or array)  -- external field (per lattice)
+    kT (float or array) -- temperature (per lattice)
+    energy (boolean)    -- also return the energy change
+
+    Returns:
+    naccept             -- accepted moves (per lattice)
+    de                  -- energy change (per lattice), if energy
+    """
+
+    nlen = s.shape[-1]
+    if numpy.mod(nlen, 2): raise ValueError("Please use even nlen")
+
+    h = numpy.asarray(h, dtype = float)[..., numpy.newaxis, numpy.newaxis]
+    kT = numpy.asarray(kT, dtype = float)[..., numpy.newaxis, numpy.newaxis]
+
+    ic, jc = numpy.indices((nlen, nlen))
+    naccept = 0
+    de = 0.0
+
+    for parity in (0, 1):
+
+        sublattice = numpy.mod(ic + jc, 2) == parity
+
+        nbr = numpy.roll(s, 1, axis = -2) + numpy.roll(s, -1, axis = -2) \
+            + numpy.roll(s, 1, axis = -1) + numpy.roll(s, -1, axis = -1)
+
+        # Energy change on flipping s
+        delta = 2.0*s*(j*nbr + h)
+        prob = numpy.exp(-numpy.maximum(delta, 0.0)/kT)
+
+        flip = sublattice & (numpy.random.uniform(size = s.shape) < prob)
+        s[flip] *= -1
+        naccept = naccept + numpy.sum(flip, axis = (-2, -1))
+        if energy:
+            de = de + numpy.sum(numpy.where(flip, delta, 0.0), axis = (-2, -1))
+
+    if energy: return naccept, de
+
+    return naccept
+
+
+def random_sequential_sweep(s, j, h, kT):
+
+    """
+    Metropolis sweep of nlen*nlen updates at randomly chosen sites.
+
+    The sites (flat indices, chosen uniformly with replacement) and
+    the uniform deviates for the whole sweep are drawn at once.
+    The sequence of sites is then split into consecutive chunks in
+    which no site appears twice or next to another, so that the
+    updates within a chunk are independent and may be done at once.
+    The result is the same as updating the sites one at a time in
+    the order drawn, so detailed balance holds exactly.
+
+    Arguments:
+    s (numpy.ndarray)  -- spins (nlen, nlen), updated in place
+    j, h, kT (float)   -- coupling, field, temperature
+
+    Returns:
+    naccept, de        -- accepted moves and energy change
+    """
+
+    nlen = s.shape[0]
+    nsite = nlen*nlen
+
+    site = numpy.random.randint(nsite, size = nsite)
+    uniform = numpy.random.uniform(size = nsite)
+
+    ic = site//nlen
+    jc = site - nlen*ic
+    nbrs = numpy.array([numpy.mod(ic - 1, nlen)*nlen + jc,
+                        numpy.mod(ic + 1, nlen)*nlen + jc,
+                        ic*nlen + numpy.mod(jc - 1, nlen),
+                        ic*nlen + numpy.mod(jc + 1, nlen)])
+
+    # previous[i] is the last position before i at which the site
+    # or one of its neighbours was drawn (or -1)
+
+    position = numpy.arange(nsite)
+    order = numpy.argsort(site, kind = 'stable')
+    key = site[order]*nsite + order
+    previous = numpy.full(nsite, -1)
+
+    for target in [site] + list(nbrs):
+        n = numpy.searchsorted(key, target*nsite + position) - 1
+        n = numpy.maximum(n, 0)
+        hit = (site[order[n]] == target) & (order[n] < position)
+        previous = numpy.where(hit, numpy.maximum(previous, order[n]),
+                               previous)
+
+    flat = s.reshape(-1)
+    naccept = 0
+    de = 0.0
+    b = 0
+
+    while b < nsite:
+
+        e = _next_conflict(previous, b)
+        chunk = site[b:e]
+
+        s0 = flat[chunk]
+        nbr = flat[nbrs[:, b:e]].sum(axis = 0)
+        delta = 2.0*s0*(j*nbr + h)
+        accept = uniform[b:e] < numpy.exp(-numpy.maximum(delta, 0.0)/kT)
+
+        flat[chunk[accept]] = -s0[accept]
+        naccept += int(numpy.sum(accept))
+        de += numpy.sum(delta[accept])
+        b = e
+
+    s[:, :] = flat.reshape(s.shape)
+
+    return naccept, de
+
+
+def _next_conflict(previous, b, window = 64):
+
+    """Return the first position i > b with previous[i] >= b"""
+
+    n = previous.size
+    start = b + 1
+
+    while start < n:
+        stop = min(n, start + window)
+        hit = numpy.nonzero(previous[start:stop] >= b)[0]
+        if hit.size > 0: return start + hit[0]
+        start = stop
+        window *= 2
+
+    return n
+
+
+def lattice_observables(s, stencil = None):
+
+    """
+    Return S, M (per site) for one or more lattices (..., nlen, nlen)
+    """
+
+    nlen = s.shape[-1]
+
+    if stencil is None or stencil == NEAREST_NEIGHBOUR:
+        bonds = s*(numpy.roll(s, 1, axis = -2) + numpy.roll(s, 1, axis = -1))
+    else:
+        bonds = 0.5*s*local_field(s, stencil)
+
+    sval = numpy.sum(bonds, axis = (-2, -1))/(1.0*nlen*nlen)
+    mval = numpy.sum(s, axis = (-2, -1))/(1.0*nlen*nlen)
+
+    return sval, mval
+
+
+def check_stencil(stencil, nlen):
+
+    """Raise ValueError unless stencil is a valid coupling stencil"""
+
+    for (di, dj), k in stencil.items():
+        if (di, dj) == (0, 0):
+            raise ValueError("Stencil must not include (0, 0)")
+        if 2*abs(di) >= nlen or 2*abs(dj) >= nlen:
+            raise ValueError("Stencil offset {} too large".format((di, dj)))
+        if stencil.get((-di, -dj)) != k:
+            raise ValueError("Stencil is not symmetric at {}".format((di, dj)))
+
+
+def j1j2_stencil(ratio):
+
+    """Nearest neighbours (K = 1) and diagonal neighbours (K = ratio)"""
+
+    stencil = dict(NEAREST_NEIGHBOUR)
+    for d in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+        stencil[d] = ratio
+
+    return stencil
+
+
+def annni_stencil(kappa, axis = 1):
+
+    """
+    Axial next-nearest neighbour Ising model: nearest neighbours
+    (K = 1) and second neighbours along one axis (K = -kappa)
+    """
+
+    stencil = dict(NEAREST_NEIGHBOUR)
+    for sign in (-1, 1):
+        d = (2*sign, 0) if axis == 0 else (0, 2*sign)
+        stencil[d] = -kappa
+
+    return stencil
+
+
+def stencil_colouring(stencil, nlen):
+
+    """
+    Return a colouring of the lattice in which no two sites of the
+    same colour are coupled by the stencil.
+
+    Colours are c(ic, jc) = (a ic + b jc) mod n with n dividing nlen
+    (so the colouring is periodic); the smallest such n is used.
+
+    Returns:
+    colour (numpy.ndarray) -- colour index (nlen, nlen)
+    """
+
+    ic, jc = numpy.indices((nlen, nlen))
+
+    for ncolour in range(2, nlen + 1):
+        if numpy.mod(nlen, ncolour): continue
+        for a in range(ncolour):
+            for b in range(ncolour):
+                if all(numpy.mod(a*di + b*dj, ncolour) != 0
+                       for (di, dj) in stencil):
+                    return numpy.mod(a*ic + b*jc, ncolour)
+
+    raise ValueError("No colouring found for stencil")
+
+
+def local_field(s, stencil, fft = None):
+
+    """
+    Return sum_d K_d s_(i+d) for one or more lattices (..., nlen, nlen)
+
+    Small stencils use shifted sums; large ones (more than
+    FFT_THRESHOLD entries, unless fft is given) use FFT convolution.
+    """
+
+    if fft is None: fft = len(stencil) > FFT_THRESHOLD
+
+    if not fft:
+        field = numpy.zeros(s.shape)
+        for (di, dj), k in stencil.items():
+            field += k*numpy.roll(s, (-di, -dj), axis = (-2, -1))
+        return field
+
+    nlen = s.shape[-1]
+    kernel = numpy.zeros((nlen, nlen))
+    for (di, dj), k in stencil.items():
+        kernel[numpy.mod(-di, nlen), numpy.mod(-dj, nlen)] += k
+
+    field = numpy.fft.irfft2(numpy.fft.rfft2(s)*numpy.fft.rfft2(kernel),
+                             s = (nlen, nlen))
+
+    return field
+
+
+def stencil_sweep(s, stencil, j, h, kT, colouring = None, energy = False):
+
+    """
+    Metropolis sweep of one or more lattices for a coupling stencil
+
+    The colours of the stencil colouring are updated in turn; sites
+    of one colour are not coupled, so each colour is updated at once.
+
+    Arguments:
+    s (numpy.ndarray)   -- spins (..., nlen, nlen), updated in place
+    stencil (dict)      -- coupling stencil
+    j (float)           -- coupling constant
+    h (float or array)  -- external field (per lattice)
+    kT (float or array) -- temperature (per lattice)
+    colouring (array)   -- from stencil_colouring() (computed if None)
+    energy (boolean)    -- also return the energy change
+
+    Returns:
+    naccept             -- accepted moves (per lattice)
+    de                  -- energy change (per lattice), if energy
+    """
+
+    if colouring is None: colouring = stencil_colouring(stencil, s.shape[-1])
+
+    h = numpy.asarray(h, dtype = float)[..., numpy.newaxis, numpy.newaxis]
+    kT = numpy.asarray(kT, dtype = float)[..., numpy.newaxis, numpy.newaxis]
+
+    naccept = 0
+    de = 0.0
+
+    for colour in range(numpy.max(colouring) + 1):
+
+        sites = colouring == colour
+
+        delta = 2.0*s*(j*local_field(s, stencil) + h)
+        prob = numpy.exp(-numpy.maximum(delta, 0.0)/kT)
+
+        flip = sites & (numpy.random.uniform(size = s.shape) < prob)
+        s[flip] *= -1
+        naccept = naccept + numpy.sum(flip, axis = (-2, -1))
+        if energy:
+            de = de + numpy.sum(numpy.where(flip, delta, 0.0), axis = (-2, -1))
+
+    if energy: return naccept, de
+
+    return naccept
+
+
+def field_schedule(hmax, npoints, ncycle = 1):
+
+    """
+    Return a triangular field schedule 0 -> hmax -> -hmax -> hmax
+
+    The initial ramp from zero is followed by ncycle full cycles,
+    with npoints field values per quarter cycle.
+    """
+
+    up = numpy.linspace(0.0, hmax, npoints + 1)
+    cycle = numpy.concatenate([up[::-1][1:], -up[1:], -up[::-1][1:], up[1:]])
+
+    return numpy.concatenate([up] + ncycle*[cycle])
+
+
+def loop_area(fields, m):
+
+    """
+    Return the area of the M(h) loop(s) for the last full cycle.
+
+    Arguments:
+    fields (numpy.ndarray) -- the field schedule
+    m (numpy.ndarray)      -- magnetisation (..., len(fields))
+    """
+
+    start, end = _last_cycle(fields)
+    h = fields[start:end + 1]
+    dm = m[..., start:end + 1]
+
+    # Trapezoidal rule for the closed contour integral of M dh
+    area = numpy.sum(0.5*(dm[..., 1:] + dm[..., :-1])*numpy.diff(h), axis = -1)
+
+    return numpy.abs(area)
+
+
+def coercive_fields(fields, m):
+
+    """
+    Return fields at which M changes sign on the descending and
+    ascending branches of the last full cycle (linear interpolation)
+
+    Returns:
+    hdown, hup (numpy.ndarray) -- NaN where there is no sign change
+    """
+
+    start, end = _last_cycle(fields)
+    h = fields[start:end + 1]
+    mcycle = numpy.atleast_2d(m[..., start:end + 1])
+    dh = numpy.diff(h)
+
+    result = []
+    for sign in (-1.0, +1.0):
+        branch = numpy.nonzero(sign*dh > 0)[0]
+        hc = numpy.full(mcycle.shape[0], numpy.nan)
+        for irep in range(mcycle.shape[0]):
+            m0 = mcycle[irep, branch]
+            m1 = mcycle[irep, branch + 1]
+            cross = numpy.nonzero(numpy.sign(m0) != numpy.sign(m1))[0]
+            if cross.size > 0:
+                n = cross[0]
+                x = m0[n]/(m0[n] - m1[n])
+                hc[irep] = h[branch[n]] + x*dh[branch[n]]
+        result.append(hc.reshape(m.shape[:-1]))
+
+    return result[0], result[1]
+
+
+def _last_cycle(fields):
+
+    """Return (start, end) indices of the last full cycle"""
+
+    # A full cycle starts and ends at the maximum field
+    top = numpy.nonzero(fields == numpy.max(fields))[0]
+    if top.size < 2: raise ValueError("Schedule has no full cycle")
+
+    return top[-2], top[-1]
@@ -0,0 +1,304 @@
+"""Throughput benchmarks for the Ising model kernels in ising.py
+
+The benchmarks measure:
+  1. attempted spin flips per second for each registered sweep
+     kernel over a range of lattice sizes and temperatures;
+  2. the cost of IsingModel.observables();
+  3. the cost of writing one report line to file (I/O), separately
+     from the cost of computing the observables for that line.
+
+Results are collected in a dict with information on the environment
+(including the git commit, if available) and may be written as JSON
+so that runs at different commits can be compared with compare().
+
+Kernels are registered in KERNELS as name: function(model), where
+the function performs one sweep of the IsingModel and returns the
+number of accepted moves.
+
+Usage (from the directory containing inputs):
+
+  python -m inputs.sources.isingbench --output bench.json
+"""
+
+from collections import OrderedDict
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import numpy
+
+from inputs.sources.ising import IsingModel
+
+KERNELS = OrderedDict()
+KERNELS["ordered"] = lambda model: model._monte_carlo_sweep(False)[0]
+KERNELS["random"] = lambda model: model._monte_carlo_sweep(True)[0]
+KERNELS["checkerboard"] = lambda model: model._checkerboard_sweep()[0]
+
+DEFAULT_SIZES = (16, 32, 64)
+DEFAULT_TEMPERATURES = (1.5, 2.269, 3.5)
+
+
+def environment():
+
+    """Return a dict describing the environment for the benchmark"""
+
+    env = OrderedDict()
+    env.update({"time": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    env.update({"python": platform.python_version()})
+    env.update({"numpy": numpy.__version__})
+    env.update({"platform": platform.platform()})
+    env.update({"machine": platform.machine()})
+    env.update({"processor": platform.processor()})
+    env.update({"commit": _git_commit()})
+
+    return env
+
+
+def time_kernel(name, nlen, kt, nsweeps=10, nrepeat=3, seed=1):
+
+    """Time a registered sweep kernel
+
+    The model is first given nsweeps sweeps to move away from the
+    initial state, and then the best of nrepeat timings of nsweeps
+    sweeps is taken.
+
+    Arguments:
+    name (string):    key in KERNELS
+    nlen (integer):   linear system size
+    kt (float):       temperature
+    nsweeps (integer):  number of sweeps per timing
+    nrepeat (integer):  number of timings
+
+    Returns:
+    result (dict):    timing and throughput information
+    """
+
+    kernel = KERNELS[name]
+    model = IsingModel(nlen, 1.0, 0.0, kt, seed)
+
+    for _ in range(nsweeps):
+        kernel(model)
+
+    times = []
+    naccept = 0
+    for _ in range(nrepeat):
+        t0 = time.perf_counter()
+        for _ in range(nsweeps):
+            naccept += kernel(model)
+        times.append(time.perf_counter() - t0)
+
+    nflip = nlen*nlen*nsweeps
+    best = min(times)
+
+    result = OrderedDict()
+    result.update({"kernel": name, "nlen": nlen, "kt": kt})
+    result.update({"nsweeps": nsweeps, "nrepeat": nrepeat})
+    result.update({"seconds_per_sweep": best/nsweeps})
+    result.update({"flips_per_second": nflip/best})
+    result.update({"acceptance": 1.0*naccept/(nflip*nrepeat)})
+
+    return result
+
+
+def time_observables(nlen, ncall=10, nrepeat=3, seed=1):
+
+    """Time IsingModel.observables()
+
+    Returns:
+    result (dict):    seconds per call and sites per second
+    """
+
+    model = IsingModel(nlen, 1.0, 0.0, 2.269, seed)
+
+    best = _best_time(model.observables, ncall, nrepeat)
+
+    result = OrderedDict()
+    result.update({"nlen": nlen, "ncall": ncall, "nrepeat": nrepeat})
+    result.update({"seconds_per_call": best/ncall})
+    result.update({"sites_per_second": nlen*nlen*ncall/best})
+
+    return result
+
+
+def time_report(nlen, nreport=100, nrepeat=3, seed=1):
+
+    """Time the reporting of observables, with I/O separated
+
+    The report update is timed without a file (observables and
+    running averages only) and with a file; the difference is the
+    cost of I/O.
+
+    Returns:
+    result (dict):    seconds per report with and without I/O
+    """
+
+    model = IsingModel(nlen, 1.0, 0.0, 2.269, seed)
+    update = lambda: model._report_update(0)
+
+    model._report_open(None)
+    tcompute = _best_time(update, nreport, nrepeat)
+    model._report_close()
+
+    handle, filename = tempfile.mkstemp(suffix=".dat")
+    os.close(handle)
+    try:
+        model._report_open(filename)
+        tfile = _best_time(update, nreport, nrepeat)
+        model._report_close()
+    finally:
+        os.remove(filename)
+
+    result = OrderedDict()
+    result.update({"nlen": nlen, "nreport": nreport, "nrepeat": nrepeat})
+    result.update({"seconds_per_report": tfile/nreport})
+    result.update({"seconds_per_report_io": max(0.0, tfile - tcompute)/nreport})
+
+    return result
+
+
+def run(sizes=DEFAULT_SIZES, temperatures=DEFAULT_TEMPERATURES,
+        kernels=None, nsweeps=10, nrepeat=3, seed=1):
+
+    """Run the full benchmark suite
+
+    Arguments:
+    sizes (sequence of integer):   lattice sizes nlen
+    temperatures (sequence of float):  values of kT
+    kernels (sequence of string):  keys in KERNELS (default all)
+
+    Returns:
+    results (dict):  "environment", "kernels", "observables", "report"
+    """
+
+    if kernels is None:
+        kernels = list(KERNELS.keys())
+
+    results = OrderedDict()
+    results.update({"environment": environment()})
+    results.update({"kernels": []})
+    results.update({"observables": []})
+    results.update({"report": []})
+
+    for nlen in sizes:
+        for kt in temperatures:
+            for name in kernels:
+                result = time_kernel(name, nlen, kt, nsweeps, nrepeat, seed)
+                results["kernels"].append(result)
+
+        results["observables"].append(time_observables(nlen, seed=seed))
+        results["report"].append(time_report(nlen, seed=seed))
+
+    return results
+
+
+def to_json(results, filename):
+
+    """Write results to file as JSON"""
+
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare(old, new):
+
+    """Compare kernel throughput in two sets of results
+
+    Arguments:
+    old, new:   JSON results file names, or results dicts from run()
+
+    Returns:
+    ratios (list of tuple): (kernel, nlen, kt, new/old flips per second)
+    for each benchmark appearing in both
+    """
+
+    old = _load(old)
+    new = _load(new)
+
+    key = lambda r: (r["kernel"], r["nlen"], r["kt"])
+    old = dict((key(r), r) for r in old["kernels"])
+
+    ratios = []
+    for r in new["kernels"]:
+        if key(r) in old:
+            ratio = r["flips_per_second"]/old[key(r)]["flips_per_second"]
+            ratios.append(key(r) + (ratio,))
+
+    return ratios
+
+
+def _load(results):
+
+    if isinstance(results, dict): return results
+
+    with open(results, "r") as f:
+        return json.load(f)
+
+
+def _best_time(function, ncall, nrepeat):
+
+    times = []
+    for _ in range(nrepeat):
+        t0 = time.perf_counter()
+        for _ in range(ncall):
+            function()
+        times.append(time.perf_counter() - t0)
+
+    return min(times)
+
+
+def _git_commit():
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=directory,
+                                         stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return commit
+
+
+def main(argv=None):
+
+    """Command line interface"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default=None, help="JSON results file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--kt", type=float, nargs="+",
+                        default=DEFAULT_TEMPERATURES)
+    parser.add_argument("--kernels", nargs="+", default=None,
+                        choices=list(KERNELS.keys()))
+    parser.add_argument("--nsweeps", type=int, default=10)
+    parser.add_argument("--nrepeat", type=int, default=3)
+    parser.add_argument("--compare", default=None,
+                        help="earlier JSON results file for comparison")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.kt, args.kernels, args.nsweeps,
+                  args.nrepeat)
+
+    for r in results["kernels"]:
+        sys.stdout.write("{:<12} {:5d} {:8.4f} {:14.4e} flips/s\n"
+                         .format(r["kernel"], r["nlen"], r["kt"],
+                                 r["flips_per_second"]))
+
+    if args.output is not None:
+        to_json(results, args.output)
+
+    if args.compare is not None:
+        for name, nlen, kt, ratio in compare(args.compare, results):
+            sys.stdout.write("{:<12} {:5d} {:8.4f} {:8.3f} x\n"
+                             .format(name, nlen, kt, ratio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Conversion between IsingModel lattices and DL-MONTE CONFIG
+
+In DL-MONTE the Ising model is represented as a single molecule
+of nlen*nlen atoms on a square lattice in the (y, z) plane, each
+atom being one of two types (see inputs/Tut_1): here an atom of
+type up (default "A core") is spin +1, and any other is spin -1.
+
+Positions are converted to lattice indices by rounding, and the
+conversion in each direction is a single array operation using
+the structured (array) form of CONFIG.
+
+Module level functions:
+
+spins_from_config()     return the spin array s[ic, jc]
+config_from_spins()     return a CONFIG for a spin array
+model_from_config()     return an IsingModel set from a CONFIG
+config_from_model()     return a CONFIG for an IsingModel
+"""
+
+import numpy
+
+import inputs.sources.dlconfig as dlconfig
+from inputs.sources.ising import IsingModel
+
+DEFAULT_UP = "A core"
+DEFAULT_DOWN = "B core"
+
+
+def spins_from_config(config, up=DEFAULT_UP):
+
+    """Return the spin array for a CONFIG
+
+    Arguments:
+    config (CONFIG):    structured CONFIG with one molecule
+    up (string):        atom type to be interpreted as spin +1
+
+    Returns:
+    s (numpy.ndarray):  spins (nlen, nlen)
+    """
+
+    if len(config.molecules) != 1:
+        raise ValueError("Expecting one molecule; found {}"\
+                         .format(len(config.molecules)))
+
+    mol = config.molecules[0]
+    if "coords" not in mol:
+        raise ValueError("Please use a structured CONFIG")
+
+    natom = mol["natom"]
+    nlen = int(round(numpy.sqrt(natom)))
+    if nlen*nlen != natom:
+        raise ValueError("Number of atoms is not square: {}".format(natom))
+
+    frac = _fractional(config, mol["coords"])
+
+    # Atoms sit at (index + 1/2)/nlen in fractional (y, z)
+    index = numpy.rint(frac[:, 1:3]*nlen - 0.5).astype(int) % nlen
+    flat = index[:, 0]*nlen + index[:, 1]
+
+    if numpy.unique(flat).size != natom:
+        raise ValueError("Atoms do not occupy each lattice site once")
+
+    spin = numpy.where(_normalise(mol["types"]) == _normalise(up), 1, -1)
+
+    s = numpy.empty(natom, dtype=int)
+    s[flat] = spin
+
+    return s.reshape(nlen, nlen)
+
+
+def config_from_spins(s, up=DEFAULT_UP, down=DEFAULT_DOWN, thickness=3.0,
+                      title="Ising model"):
+
+    """Return a structured CONFIG for a spin array
+
+    Arguments:
+    s (numpy.ndarray):   spins (nlen, nlen)
+    up (string):         atom type for spin +1
+    down (string):       atom type for spin -1
+    thickness (float):   length of the cell in x
+    title (string):      CONFIG title
+
+    Returns:
+    config (CONFIG):     fractional coordinates, one molecule "ising"
+    """
+
+    nlen = s.shape[0]
+    if s.shape != (nlen, nlen):
+        raise ValueError("Expecting a square lattice")
+
+    natom = nlen*nlen
+    ic, jc = numpy.indices((nlen, nlen))
+
+    coords = numpy.zeros((natom, 3))
+    coords[:, 1] = (ic.ravel() + 0.5)/nlen
+    coords[:, 2] = (jc.ravel() + 0.5)/nlen
+
+    types = numpy.where(s.ravel() > 0, up, down)
+
+    vcell = [[thickness, 0.0, 0.0], [0.0, 1.0*nlen, 0.0],
+             [0.0, 0.0, 1.0*nlen]]
+
+    mol = {"name": "ising", "natom": natom, "nmaxatom": natom,
+           "types": types, "coords": coords}
+
+    return dlconfig.CONFIG(title, dlconfig.DLPOLY_LEVEL_ZERO,
+                           dlconfig.DLMONTE_FORMAT_FRACTIONAL, vcell,
+                           [1, 1], [mol])
+
+
+def model_from_config(config, j, h, kT, seed, up=DEFAULT_UP):
+
+    """Return an IsingModel with spins set from a CONFIG"""
+
+    s = spins_from_config(config, up)
+    model = IsingModel(s.shape[0], j, h, kT, seed, init="cold")
+    model.s[:, :] = s
+    model.initial_state = "config"
+
+    return model
+
+
+def config_from_model(model, up=DEFAULT_UP, down=DEFAULT_DOWN):
+
+    """Return a structured CONFIG for the current IsingModel state"""
+
+    return config_from_spins(model.s, up, down)
+
+
+def _fractional(config, coords):
+
+    """Return fractional coordinates (natom, 3)"""
+
+    if config.dlformat == dlconfig.DLMONTE_FORMAT_FRACTIONAL:
+        return coords
+
+    # Cartesian r = f . vcell (lattice vectors are rows)
+    vcell = numpy.array(config.vcell)
+
+    return numpy.linalg.solve(vcell.T, coords.T).T
+
+
+def _normalise(label):
+
+    """Compare types independent of case and spacing"""
+
+    return numpy.char.upper(numpy.char.replace(numpy.asarray(label),
+                                               " ", ""))
@@ -1,21 +1,30 @@
-"""Read data associated with test Ising model in ising.py"""
+"""Read data associated with test Ising model in ising.py
+
+IsingModelData      data from one run (file written by IsingModel.run)
+reweight_surface()  joint (kT, h) reweighting of one or more data sets
+"""
 
 # To ignore pylint numpy "no-member" errors...
 # pylint: disable=E1101
 
 import re
+import functools
+
 import numpy
 
 import inputs.obs
 import inputs.util
+import inputs.resample
 from inputs.util import Label
 from inputs.util import Observable
 from inputs.ensemble import EnsembleNVT
 from inputs.parameter import Parameter
 
-#from htk.histogram import BetaReweighter
-#from htk.histogram import KTReweighter
-#from htk.histogram import Reweighter
+from inputs.histogram import BetaReweighter
+from inputs.histogram import KTReweighter
+from inputs.histogram import Reweighter
+from inputs.histogram import PeakLocator
+from inputs.histogram import ReweightEstimator
 
 class IsingModelData(inputs.obs.ObservableData):
 
@@ -132,19 +141,222 @@ class IsingModelData(inputs.obs.ObservableData):
         e1 = volume*e0[:]
         e2 = e1[:]*e1[:]
 
-        try:
-            cvnew = []
-            for kt in ktnew:
-                e1r = self.reweighter("kt").reweight_obs(e1, kt)
-                e2r = self.reweighter("kt").reweight_obs(e2, kt)
-                cv = htk.util.nvt_cv(e1r, e2r, kt, volume)
-                cvnew.append(cv)
+        # All temperatures and both moments in one pass
 
-            cvnew = numpy.array(cvnew)
-
-        except TypeError:
-            e1r = self.reweighter("kt").reweight_obs(e1, ktnew)
-            e2r = self.reweighter("kt").reweight_obs(e2, ktnew)
-            cvnew = htk.util.nvt_cv(e1r, e2r, ktnew, volume)
+        er = self.reweighter("kt").reweight_obs(numpy.stack([e1, e2], 1),
+                                                ktnew)
+        cvnew = inputs.util.nvt_cv(er[..., 0], er[..., 1],
+                                   numpy.asarray(ktnew), volume)
 
         return cvnew
+
+
+    def reweight_surface(self, kt, h, blocksize=2**22):
+
+        """Joint (kT, h) reweighting of this data set
+
+        See reweight_surface()
+        """
+
+        return reweight_surface([self], kt, h, blocksize)
+
+
+    def reweight_cv_error(self, ktnew, nblock=20, method="bootstrap",
+                          nresample=200, seed=None, processes=1):
+
+        """Reweight C_V to new temperatures with a resampling error
+
+        The series is cut into nblock blocks, and resamples of the
+        blocks are reweighted in batches, optionally over a pool of
+        processes (see inputs.resample).
+
+        Arguments:
+        ktnew (float or numpy.ndarray):  the new temperatures
+        nblock (integer):     number of blocks
+        method (string):      "bootstrap" or "jackknife"
+        nresample (integer):  number of bootstrap resamples
+        seed (integer):       bootstrap random seed
+        processes (integer):  number of processes (1 for none;
+                              None for one per CPU)
+
+        Returns:
+        cv, error:            specific heat capacity and its error
+        """
+
+        volume = float(self.parameter("V"))
+        e1 = volume*self.observable("e").data
+        obs = numpy.stack([e1, e1*e1], 1)
+
+        response = functools.partial(_cv_response, volume)
+        estimator = ReweightEstimator(self.reweighter("kt"), obs, ktnew,
+                                      nblock, response)
+
+        if method == "bootstrap":
+            result = inputs.resample.bootstrap(estimator, nblock, nresample,
+                                               seed, processes=processes)
+        elif method == "jackknife":
+            result = inputs.resample.jackknife(estimator, nblock,
+                                               processes=processes)
+        else:
+            raise ValueError("Unknown method {!r}".format(method))
+
+        cv = result["estimate"]
+        error = result["error"]
+        if numpy.ndim(ktnew) == 0:
+            cv, error = cv[0], error[0]
+
+        return cv, error
+
+
+    def find_peak(self, bracket, quantity="cv", nblock=10, tol=1.0e-8,
+                  method="jackknife", nresample=200, seed=None, processes=1):
+
+        """Locate the maximum of C_V or the susceptibility in kT
+
+        Arguments:
+        bracket (tuple):     interval (kt0, kt1) to search
+        quantity (string):   "cv", "chi" (from <M>), or "chi_abs"
+                             (from <|M|>), all per site
+        nblock (integer):    number of blocks for the error
+        method (string):     "jackknife" or "bootstrap" (with
+                             nresample, seed, processes)
+
+        Returns:
+        peak (dict):  "location" (kT), "height", and errors
+                      "location_error" and "height_error" (see
+                      inputs.histogram.PeakLocator.locate())
+        """
+
+        volume = float(self.parameter("V"))
+        e = self.observable("e").data
+        m = self.observable("m").data
+
+        if quantity == "cv":
+            obs = numpy.stack([volume*e, (volume*e)**2], 1)
+            response = functools.partial(_cv_response, volume)
+        elif quantity == "chi":
+            obs = numpy.stack([m, m*m], 1)
+            response = functools.partial(_chi_response, volume)
+        elif quantity == "chi_abs":
+            obs = numpy.stack([numpy.abs(m), m*m], 1)
+            response = functools.partial(_chi_response, volume)
+        else:
+            raise ValueError("Unknown quantity {!r}".format(quantity))
+
+        locator = PeakLocator(self.reweighter("kt"), obs, response, nblock)
+
+        return locator.locate(bracket, tol=tol, method=method,
+                              nresample=nresample, seed=seed,
+                              processes=processes)
+
+
+def _cv_response(volume, kt, a):
+
+    """C_V from averages a[..., 0] = <E>, a[..., 1] = <E^2> (system)"""
+
+    return inputs.util.nvt_cv(a[..., 0], a[..., 1], kt, volume)
+
+
+def _chi_response(volume, kt, a):
+
+    """Susceptibility from averages a[..., 0] = <M>, a[..., 1] = <M^2>"""
+
+    return (volume/kt)*(a[..., 1] - a[..., 0]*a[..., 0])
+
+
+def reweight_surface(datasets, kt, h, blocksize=2**22):
+
+    """Reweight Ising model data to a grid of (kT, h) in one pass
+
+    The Boltzmann weight of a state with interaction energy S and
+    magnetisation M (per site) is exp(beta V (J S + h M)), so the
+    reweighting in both kT and h uses the joint (S, M) observations.
+    The data are collapsed to distinct (S, M) pairs, and the data
+    sets are combined by multiple histogram (MBAR) reweighting with
+    reduced energies u_k = -beta_k V (J S + h_k M) of each pair in
+    run k. All data sets must have the same system size and J.
+
+    Arguments:
+    datasets (list of IsingModelData):  the data (or one data set)
+    kt (numpy.ndarray):                 target temperatures (nkt)
+    h (numpy.ndarray):                  target external fields (nh)
+    blocksize (integer):                maximum number of (target,
+                                        level) weights held at once
+
+    Returns:
+    surface (dict):  grids (nkt, nh) for "kt", "h" and the averages
+                     "e" (per site), "s", "m", "abs_m", "cv" (per
+                     site), "chi" and "chi_abs" (susceptibility from
+                     M and |M|), "binder" (1 - <M^4>/3<M^2>^2); also
+                     "f" the free energies of the data sets
+    """
+
+    if isinstance(datasets, IsingModelData):
+        datasets = [datasets]
+
+    volume = float(datasets[0].parameter("V"))
+    j = float(datasets[0].parameter("J"))
+
+    for data in datasets:
+        if float(data.parameter("V")) != volume or \
+           float(data.parameter("J")) != j:
+            raise ValueError("Data sets must have the same V and J")
+
+    # Collapse all (S, M) observations to distinct pairs
+
+    beta = numpy.array([1.0/float(d.parameter("kT")) for d in datasets])
+    hrun = numpy.array([float(d.parameter("H")) for d in datasets])
+    ndata = numpy.array([d.observable("s").data.size for d in datasets])
+
+    sm = numpy.concatenate([numpy.stack([d.observable("s").data,
+                                         d.observable("m").data], 1)
+                            for d in datasets])
+    levels, count = numpy.unique(sm, axis=0, return_counts=True)
+    s = levels[:, 0]
+    m = levels[:, 1]
+
+    # Free energies of the runs, and the log weight of each level
+    # with the run-dependent denominator removed
+
+    u = -volume*beta[:, numpy.newaxis]*(j*s + hrun[:, numpy.newaxis]*m)
+    logc = numpy.log(ndata)
+    logw = numpy.log(count)
+    f, _ = inputs.util.mbar_solve(u, logc, logw)
+    loga = logw - inputs.util.mbar_log_denominator(u, logc, f)
+
+    ktgrid, hgrid = numpy.meshgrid(numpy.atleast_1d(kt), numpy.atleast_1d(h),
+                                   indexing="ij")
+    bnew = volume/ktgrid.ravel()
+    hnew = hgrid.ravel()
+
+    moments = numpy.stack([s, m, numpy.abs(m), s*s, s*m, m*m, m**4], 1)
+    averages = numpy.zeros((bnew.size, moments.shape[1]))
+    nblock = max(1, blocksize//max(1, s.size))
+
+    for i in range(0, bnew.size, nblock):
+        b = bnew[i:i + nblock, numpy.newaxis]
+        logb = loga + b*j*s + b*hnew[i:i + nblock, numpy.newaxis]*m
+        logb -= inputs.util.log_sum_exp(logb, axis=1)[:, numpy.newaxis]
+        averages[i:i + nblock] = numpy.dot(numpy.exp(logb), moments)
+
+    s1, m1, a1, s2, sm1, m2, m4 = [x.reshape(ktgrid.shape)
+                                   for x in averages.T]
+
+    e1 = -j*s1 - hgrid*m1
+    e2 = j*j*s2 + 2.0*j*hgrid*sm1 + hgrid*hgrid*m2
+
+    surface = {}
+    surface["kt"] = ktgrid
+    surface["h"] = hgrid
+    surface["e"] = e1
+    surface["s"] = s1
+    surface["m"] = m1
+    surface["abs_m"] = a1
+    surface["cv"] = inputs.util.nvt_cv(volume*e1, volume*volume*e2,
+                                       ktgrid, volume)
+    surface["chi"] = (volume/ktgrid)*(m2 - m1*m1)
+    surface["chi_abs"] = (volume/ktgrid)*(m2 - a1*a1)
+    surface["binder"] = 1.0 - m4/(3.0*m2*m2)
+    surface["f"] = f
+
+    return surface
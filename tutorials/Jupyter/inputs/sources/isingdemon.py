@@ -0,0 +1,261 @@
+"""Microcanonical (Creutz demon) dynamics for IsingModel
+
+Each lattice site carries a demon holding a non-negative energy
+(Creutz, Phys. Rev. Lett. 50, 1411 (1983)). A spin flip with energy
+change delta is accepted if, and only if, the demon at the site can
+supply it (delta <= E_d), whereupon E_d -= delta. The total energy
+of lattice plus demons is conserved, and no random numbers are used
+in the acceptance.
+
+As in the checkerboard update, the two sublattices are updated in
+turn, each all at once. The demons are shifted by a random offset
+after each sweep (two random integers per sweep) so that energy is
+carried around the lattice. Note that a uniform lattice with uniform
+demons (e.g., a cold start) is a periodic orbit of the dynamics: use
+a hot start, or non-uniform initial demon energies.
+
+In equilibrium the demon energies have the Boltzmann distribution
+P(E_d) ~ exp(-E_d/kT), so the temperature is measured from the
+histogram of demon energies. The data from a run are returned as
+ObservableData in the microcanonical ensemble EnsembleNVE.
+"""
+
+import numpy
+
+import inputs.obs
+from inputs.util import Label
+from inputs.util import Observable
+from inputs.ensemble import EnsembleNVE
+from inputs.sources.ising import NEAREST_NEIGHBOUR
+from inputs.sources.ising import lattice_observables
+
+
+class CreutzDemon(object):
+
+    """Creutz demon engine for an IsingModel"""
+
+    def __init__(self, model, demon_energy = 0.0, shift = True):
+
+        """
+        Arguments:
+        model (IsingModel)   -- provides the lattice, j and h; the
+                                lattice is updated in place
+        demon_energy (float or numpy.ndarray)
+                             -- initial energy of each demon
+        shift (boolean)      -- shift demons each sweep
+        """
+
+        if numpy.any(numpy.asarray(demon_energy) < 0.0):
+            raise ValueError("Demon energy must be non-negative")
+
+        if model.stencil != NEAREST_NEIGHBOUR:
+            raise ValueError("Creutz demon requires nearest neighbours")
+
+        self.model = model
+        self.nlen = model.nlen
+        self.j = model.j
+        self.h = model.h
+        self.shift = shift
+        self.ensemble = EnsembleNVE()
+
+        self.demons = numpy.zeros((self.nlen, self.nlen))
+        self.demons[:, :] = demon_energy
+        self.nsweep = 0
+        self.reset_histogram()
+
+
+    def __repr__(self):
+
+        me = "nlen= {!r}, nsweep= {!r}, total_energy= {!r}"\
+            .format(self.nlen, self.nsweep, self.total_energy())
+
+        return "CreutzDemon({!s})".format(me)
+
+
+    def lattice_energy(self):
+
+        """Return the energy of the lattice (whole system)"""
+
+        s, m = lattice_observables(self.model.s)
+        nsite = self.nlen*self.nlen
+
+        return -nsite*(self.j*s + self.h*m)
+
+
+    def demon_energy(self):
+
+        """Return the mean demon energy (per site)"""
+
+        return numpy.mean(self.demons)
+
+
+    def total_energy(self):
+
+        """Return the conserved energy of lattice and demons"""
+
+        return self.lattice_energy() + numpy.sum(self.demons)
+
+
+    def sweep(self):
+
+        """One sweep (two sublattice half-sweeps); returns the number
+        of accepted flips"""
+
+        s = self.model.s
+        d = self.demons
+        nlen = self.nlen
+        ic, jc = numpy.indices((nlen, nlen))
+        tolerance = 1.0e-9*(abs(self.j) + abs(self.h))
+        naccept = 0
+
+        for parity in (0, 1):
+
+            sublattice = numpy.mod(ic + jc, 2) == parity
+            nbr = numpy.roll(s, 1, axis = 0) + numpy.roll(s, -1, axis = 0) \
+                + numpy.roll(s, 1, axis = 1) + numpy.roll(s, -1, axis = 1)
+
+            delta = 2.0*s*(self.j*nbr + self.h)
+            flip = sublattice & (delta <= d + tolerance)
+
+            s[flip] *= -1
+            d[flip] -= delta[flip]
+            naccept += int(numpy.sum(flip))
+
+        if self.shift:
+            offset = numpy.random.randint(nlen, size = 2)
+            self.demons = numpy.roll(d, tuple(offset), axis = (0, 1))
+
+        self.nsweep += 1
+
+        return naccept
+
+
+    def run_iter(self, nsteps, report_freq = 1, ndiscard = 0):
+
+        """
+        Run a number of sweeps, yielding (step, S, M, E_d) at each
+        report step, where E_d is the mean demon energy. The demon
+        energies are added to the histogram after ndiscard steps.
+        """
+
+        for n in range(1, nsteps + 1):
+
+            self.sweep()
+
+            if n > ndiscard and numpy.mod(n, report_freq) == 0:
+                self.accumulate_histogram()
+                s, m = lattice_observables(self.model.s)
+                yield (n, s, m, self.demon_energy())
+
+
+    def run(self, nsteps, report_freq = 1, ndiscard = 0):
+
+        """
+        Run a number of sweeps and return the data
+
+        Returns:
+        data (ObservableData) -- ensemble NVE, with observables t, S,
+                                 M, E (lattice) and Ed (demon) per
+                                 site, and parameters including the
+                                 total energy and measured kT
+        """
+
+        records = numpy.array(list(self.run_iter(nsteps, report_freq,
+                                                 ndiscard)))
+        if records.size == 0:
+            records = numpy.zeros((0, 4))
+
+        nsite = self.nlen*self.nlen
+        etotal = self.total_energy()
+
+        data = inputs.obs.ObservableData(self.ensemble)
+        data.data_source = "CreutzDemon"
+        data.data_type = "Ising Model (2d) {0}x{0}".format(self.nlen)
+
+        data.add_parameter(int(nsite), Label("N", "Number of spins", None))
+        data.add_parameter(float(nsite), Label("V", "Volume", "sites"))
+        data.add_parameter(float(self.j), Label("J", "Coupling constant",
+                                                "k_bT"))
+        data.add_parameter(float(self.h), Label("H", "External field",
+                                                "k_bT"))
+        data.add_parameter(float(etotal)/nsite,
+                           Label("E_tot", "Conserved energy", "k_bT/site"))
+        data.add_parameter(float(self.temperature()),
+                           Label("kT", "Temperature (demon)", "k_bT"))
+
+        t = records[:, 0]
+        s = records[:, 1]
+        m = records[:, 2]
+        ed = records[:, 3]
+        e = -self.j*s - self.h*m
+
+        data.add_observable(Observable(t, Label("t", "Time", "MC Sweeps")),
+                            independent_variable=True)
+        data.add_observable(Observable(s, Label("S", "Interaction Energy",
+                                                "k_bT/site")))
+        data.add_observable(Observable(m, Label("M", "Magnetisation",
+                                                "k_bT/site")))
+        data.add_observable(Observable(e, Label("E", "Total Energy",
+                                                "k_bT/site")))
+        data.add_observable(Observable(ed, Label("Ed", "Demon Energy",
+                                                 "k_bT/site")))
+
+        return data
+
+
+    def reset_histogram(self):
+
+        """Clear the histogram of demon energies"""
+
+        self._levels = numpy.zeros(0)
+        self._counts = numpy.zeros(0, dtype = numpy.int64)
+
+
+    def accumulate_histogram(self):
+
+        """Add the current demon energies to the histogram"""
+
+        # Demon energies take discrete values; round away noise
+        values = numpy.round(self.demons.ravel(), 9)
+        levels = numpy.concatenate([self._levels, values])
+        weights = numpy.concatenate([self._counts,
+                                     numpy.ones(values.size, dtype = int)])
+
+        self._levels, index = numpy.unique(levels, return_inverse = True)
+        self._counts = numpy.bincount(index.ravel(), weights = weights)\
+                            .astype(numpy.int64)
+
+
+    def histogram(self):
+
+        """Return (levels, counts) of demon energies accumulated"""
+
+        return self._levels.copy(), self._counts.copy()
+
+
+    def temperature(self):
+
+        """
+        Return kT from the demon energy histogram by weighted least
+        squares fit of ln P(E_d) = const - E_d/kT (the variance of
+        ln n is approximately 1/n for n counts). Returns NaN if there
+        are fewer than two occupied levels.
+        """
+
+        keep = self._counts > 0
+        x = self._levels[keep]
+        n = self._counts[keep].astype(float)
+
+        if x.size < 2:
+            return numpy.nan
+
+        w = n/numpy.sum(n)
+        y = numpy.log(n)
+        xbar = numpy.sum(w*x)
+        ybar = numpy.sum(w*y)
+        slope = numpy.sum(w*(x - xbar)*(y - ybar))/numpy.sum(w*(x - xbar)**2)
+
+        if slope >= 0.0:
+            return numpy.inf
+
+        return -1.0/slope
@@ -0,0 +1,353 @@
+"""Event-log trajectories for IsingModel runs
+
+Rather than storing a snapshot of the lattice at every sweep, the
+sites whose spin has changed during each sweep are logged. The flat
+site indices (ic*nlen + jc) are sorted, delta-encoded, and written
+as unsigned LEB128 variable length integers ("varints"), so a sweep
+in which few spins change costs a few bytes. The full lattice is
+written as a keyframe (one bit per site) every keyframe_freq sweeps,
+and an index of keyframes is written at the end of the file, so that
+the lattice at any sweep is reconstructed by seeking to the nearest
+earlier keyframe and applying the events that follow.
+
+File layout:
+  header    MAGIC, version, nlen, keyframe_freq (varints)
+  records   b"K" varint(sweep) packed-bits   keyframe
+            b"D" varint(nflip) varint(nbytes) varints    events
+  index     varint(nkey) then varint(sweep), varint(offset) per key
+  trailer   8-byte little-endian offset of index, MAGIC
+
+The classes EventWriter and EventReader are provided; the writer is
+normally used via IsingModel.run(..., events=filename).
+"""
+
+import struct
+
+import numpy
+
+MAGIC = b"ISEV"
+VERSION = 1
+TAG_KEYFRAME = b"K"
+TAG_EVENTS = b"D"
+
+
+class EventWriter(object):
+
+    """Write an event-log trajectory"""
+
+    def __init__(self, filename, nlen, keyframe_freq = 100):
+
+        """
+        Arguments:
+        filename (string)        -- output file
+        nlen (integer)           -- linear system size
+        keyframe_freq (integer)  -- sweeps between keyframes
+        """
+
+        if keyframe_freq < 1: raise ValueError("keyframe_freq must be >= 1")
+
+        self.filename = filename
+        self.nlen = nlen
+        self.keyframe_freq = keyframe_freq
+        self.nsweep = None
+        self._keys = []
+        self._previous = None
+
+        self._file = open(filename, "wb")
+        self._file.write(MAGIC)
+        self._file.write(encode_varints([VERSION, nlen, keyframe_freq]))
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+    def record(self, nsweep, s):
+
+        """
+        Record the lattice s at sweep nsweep. The first call writes
+        a keyframe; subsequent calls (one per sweep, in order) write
+        the events since the previous call, and a keyframe when
+        nsweep is a multiple of keyframe_freq.
+        """
+
+        flat = s.reshape(-1)
+
+        if self._previous is None:
+            self._keyframe(nsweep, flat)
+        else:
+            if nsweep != self.nsweep + 1:
+                raise ValueError("Sweeps must be recorded in order")
+            flips = numpy.nonzero(flat != self._previous)[0]
+            self._events(flips)
+            if nsweep % self.keyframe_freq == 0:
+                self._keyframe(nsweep, flat)
+
+        self.nsweep = nsweep
+        self._previous = flat.copy()
+
+
+    def close(self):
+
+        """Write the index and close the file"""
+
+        if self._file is None: return
+
+        offset = self._file.tell()
+        values = [len(self._keys)]
+        for key in self._keys:
+            values.extend(key)
+        self._file.write(encode_varints(values))
+        self._file.write(struct.pack("<Q", offset))
+        self._file.write(MAGIC)
+        self._file.close()
+        self._file = None
+
+
+    def _keyframe(self, nsweep, flat):
+
+        self._keys.append((nsweep, self._file.tell()))
+        self._file.write(TAG_KEYFRAME)
+        self._file.write(encode_varints([nsweep]))
+        self._file.write(numpy.packbits(flat > 0).tobytes())
+
+
+    def _events(self, flips):
+
+        payload = encode_varints(numpy.diff(flips, prepend = 0))
+        self._file.write(TAG_EVENTS)
+        self._file.write(encode_varints([flips.size, len(payload)]))
+        self._file.write(payload)
+
+
+class EventReader(object):
+
+    """Replay an event-log trajectory"""
+
+    def __init__(self, filename):
+
+        """Read the header and keyframe index"""
+
+        self.filename = filename
+
+        with open(filename, "rb") as f:
+            self._data = f.read()
+
+        data = self._data
+        if data[:4] != MAGIC or data[-4:] != MAGIC:
+            raise ValueError("Not an event log: {!r}".format(filename))
+
+        (version, self.nlen, self.keyframe_freq), n = _read_varints(data, 4, 3)
+        if version != VERSION:
+            raise ValueError("Unsupported version {}".format(version))
+
+        offset = struct.unpack("<Q", data[-12:-4])[0]
+        (nkey,), n = _read_varints(data, offset, 1)
+        keys, _ = _read_varints(data, n, 2*nkey)
+        self.key_sweeps = numpy.array(keys[0::2], dtype = int)
+        self.key_offsets = numpy.array(keys[1::2], dtype = int)
+        self._end = offset
+
+        self.first_sweep = int(self.key_sweeps[0])
+        self.last_sweep = self._last_sweep()
+
+
+    def __repr__(self):
+
+        me = "filename= {!r}, nlen= {!r}, sweeps= {!r}-{!r}"\
+            .format(self.filename, self.nlen, self.first_sweep,
+                    self.last_sweep)
+
+        return "EventReader({!s})".format(me)
+
+
+    def lattice(self, nsweep):
+
+        """Return the lattice (nlen, nlen) at sweep nsweep"""
+
+        if nsweep < self.first_sweep or nsweep > self.last_sweep:
+            raise IndexError("Sweep {} not in trajectory".format(nsweep))
+
+        k = numpy.searchsorted(self.key_sweeps, nsweep, side = "right") - 1
+        sweep, flat, n = self._read_keyframe(self.key_offsets[k])
+
+        while sweep < nsweep:
+            tag = self._data[n:n + 1]
+            if tag == TAG_KEYFRAME:
+                sweep, flat, n = self._read_keyframe(n)
+                continue
+            flips, n = self._read_events(n)
+            flat[flips] *= -1
+            sweep += 1
+
+        return flat.reshape(self.nlen, self.nlen)
+
+
+    def flips(self, nsweep):
+
+        """Return the flat indices of sites changed in sweep nsweep"""
+
+        before = self.lattice(nsweep - 1)
+        after = self.lattice(nsweep)
+
+        return numpy.nonzero(before.reshape(-1) != after.reshape(-1))[0]
+
+
+    def replay(self, first = None, last = None):
+
+        """Yield (nsweep, lattice) for each sweep in turn"""
+
+        first = self.first_sweep if first is None else first
+        last = self.last_sweep if last is None else last
+
+        s = self.lattice(first)
+        flat = s.reshape(-1)
+        yield first, s.copy()
+
+        sweep = first
+        n = self._position(first)
+        while sweep < last:
+            if self._data[n:n + 1] == TAG_KEYFRAME:
+                _, _, n = self._read_keyframe(n)
+                continue
+            flips, n = self._read_events(n)
+            flat[flips] *= -1
+            sweep += 1
+            yield sweep, s.copy()
+
+
+    def _position(self, nsweep):
+
+        """Return the offset of the first record after sweep nsweep"""
+
+        k = numpy.searchsorted(self.key_sweeps, nsweep, side = "right") - 1
+        sweep, _, n = self._read_keyframe(self.key_offsets[k])
+
+        while sweep < nsweep:
+            if self._data[n:n + 1] == TAG_KEYFRAME:
+                sweep, _, n = self._read_keyframe(n)
+                continue
+            n = self._skip(n)
+            sweep += 1
+
+        return n
+
+
+    def _last_sweep(self):
+
+        k = len(self.key_sweeps) - 1
+        sweep, _, n = self._read_keyframe(self.key_offsets[k])
+
+        while n < self._end:
+            n = self._skip(n)
+            sweep += 1
+
+        return sweep
+
+
+    def _read_keyframe(self, n):
+
+        assert self._data[n:n + 1] == TAG_KEYFRAME
+        (sweep,), n = _read_varints(self._data, n + 1, 1)
+        nsite = self.nlen*self.nlen
+        nbyte = (nsite + 7)//8
+        bits = numpy.frombuffer(self._data, dtype = numpy.uint8,
+                                count = nbyte, offset = n)
+        flat = 2*numpy.unpackbits(bits)[:nsite].astype(int) - 1
+
+        return sweep, flat, n + nbyte
+
+
+    def _read_events(self, n):
+
+        assert self._data[n:n + 1] == TAG_EVENTS
+        (nflip, nbyte), n = _read_varints(self._data, n + 1, 2)
+        payload = numpy.frombuffer(self._data, dtype = numpy.uint8,
+                                   count = nbyte, offset = n)
+        flips = numpy.cumsum(decode_varints(payload, nflip))
+
+        return flips, n + nbyte
+
+
+    def _skip(self, n):
+
+        """Skip an events record"""
+
+        (_, nbyte), n = _read_varints(self._data, n + 1, 2)
+
+        return n + nbyte
+
+
+def encode_varints(values):
+
+    """Encode non-negative integers as LEB128 varints (bytes)"""
+
+    values = numpy.asarray(values, dtype = numpy.uint64).ravel()
+    if values.size == 0:
+        return b""
+
+    # Number of 7-bit groups for each value
+    nbits = numpy.zeros(values.size, dtype = int)
+    v = values.copy()
+    while numpy.any(v):
+        nbits += (v > 0)
+        v >>= numpy.uint64(7)
+    ngroup = numpy.maximum(nbits, 1)
+
+    # Byte k of value i is bits 7k..7k+6, with the continuation bit
+    # set unless it is the last byte of the value
+    start = numpy.cumsum(ngroup) - ngroup
+    owner = numpy.repeat(numpy.arange(values.size), ngroup)
+    k = numpy.arange(owner.size) - start[owner]
+    shift = (7*k).astype(numpy.uint64)
+    out = (values[owner] >> shift) & numpy.uint64(0x7f)
+    out |= numpy.where(k < ngroup[owner] - 1, 0x80, 0).astype(numpy.uint64)
+
+    return out.astype(numpy.uint8).tobytes()
+
+
+def decode_varints(payload, count = None):
+
+    """Decode LEB128 varints from a uint8 array to an int64 array"""
+
+    b = numpy.asarray(payload, dtype = numpy.uint8)
+    if b.size == 0:
+        return numpy.zeros(0, dtype = numpy.int64)
+
+    last = numpy.nonzero((b & 0x80) == 0)[0]
+    start = numpy.concatenate([[0], last[:-1] + 1])
+    owner = numpy.repeat(numpy.arange(last.size), last - start + 1)
+    k = numpy.arange(owner.size) - start[owner]
+    parts = (b[:owner.size] & 0x7f).astype(numpy.int64) << (7*k)
+    values = numpy.add.reduceat(parts, start)
+
+    if count is not None:
+        assert values.size == count, "Corrupt event record"
+
+    return values
+
+
+def _read_varints(data, n, count):
+
+    """Read count varints from bytes data at offset n (scalar)"""
+
+    values = []
+    for _ in range(count):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[n]
+            n += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        values.append(value)
+
+    return values, n
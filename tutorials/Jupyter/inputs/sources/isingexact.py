@@ -0,0 +1,464 @@
+"""Exact density of states for the finite two-dimensional Ising model
+
+The partition function of a periodic nlen x nlen Ising lattice in
+zero field is known in closed form (Kaufman, Phys. Rev. 76, 1232
+(1949)). Beale (Phys. Rev. Lett. 76, 78 (1996)) showed that the
+closed form may be expanded to give the exact number of states g(S)
+at each value of the interaction energy S = \\sum_ij s_i s_j.
+
+The expansion is performed here by evaluating Kaufman's expression
+at a set of complex points on the unit circle using fixed point
+(arbitrary precision integer) arithmetic, and recovering the
+coefficients by a discrete Fourier transform. The result is rounded
+to integers and checked (sum over g is 2^N, and the imaginary parts
+vanish); the working precision is increased until the checks pass.
+
+The calculation costs O(N^2) arbitrary precision operations for
+N = nlen^2 spins, so the result is cached on disk per nlen as JSON.
+
+The class IsingDensityOfStates holds g(S) and computes exact
+thermodynamic averages for the IsingModel Hamiltonian (with h = 0)
+at any number of temperatures in one vectorised evaluation.
+
+A module level convenience density_of_states() is supplied as a
+factory method.
+"""
+
+import os
+import json
+import math
+
+import numpy
+
+import inputs.util as util
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache",
+                                 "ising_dos")
+
+
+class IsingDensityOfStates(object):
+
+    """Exact density of states g(S) for periodic nlen x nlen lattice"""
+
+    def __init__(self, nlen, directory=DEFAULT_DIRECTORY):
+
+        """Load g(S) from the cache, or compute it (and cache it).
+
+        Arguments:
+        nlen (integer):       linear system size (must be even)
+        directory (string):   location of the cache; if None, the
+                              result is not cached
+        """
+
+        if nlen < 2 or numpy.mod(nlen, 2):
+            raise ValueError("Please use even nlen")
+
+        self.nlen = nlen
+        self.directory = directory
+
+        dos = None
+        if directory is not None:
+            dos = self._load(self.filename())
+
+        if dos is None:
+            dos = _density_of_states(nlen)
+            if directory is not None:
+                self._save(self.filename(), dos)
+
+        self.s = numpy.array(dos["s"], dtype=numpy.int64)
+        self.g = dos["g"]
+
+
+    def __repr__(self):
+
+        """Return a short description"""
+
+        me = "nlen= {!r}, directory= {!r}".format(self.nlen, self.directory)
+
+        return "IsingDensityOfStates({!s})".format(me)
+
+
+    def filename(self):
+
+        """Return the name of the cache file for this system size"""
+
+        name = "ising_dos_L{:d}.json".format(self.nlen)
+
+        return os.path.join(self.directory, name)
+
+
+    def log_g(self):
+
+        """Return ln g(S) for the levels with g(S) > 0
+
+        Returns:
+        s (numpy.ndarray):       interaction energies S (whole lattice)
+        lng (numpy.ndarray):     ln g(S)
+        """
+
+        keep = [n for n in range(len(self.g)) if self.g[n] > 0]
+        lng = numpy.array([math.log(self.g[n]) for n in keep])
+
+        return self.s[keep], lng
+
+
+    def thermodynamics(self, kt, j=1.0):
+
+        """Exact thermodynamic quantities per site at temperature(s) kt
+
+        The energy is E = -j S (there is no field). All targets are
+        evaluated together from one matrix of log weights.
+
+        Arguments:
+        kt (float or numpy.ndarray):   temperature(s)
+        j (float):                     coupling constant
+
+        Returns:
+        e (numpy.ndarray):     <E> per site
+        cv (numpy.ndarray):    specific heat capacity per site
+        f (numpy.ndarray):     free energy per site
+        """
+
+        kt = numpy.atleast_1d(numpy.asarray(kt, dtype=float))
+        assert numpy.all(kt > 0.0), "Check kT > 0"
+
+        volume = 1.0*self.nlen*self.nlen
+        s, lng = self.log_g()
+        e = -j*s.astype(float)
+
+        # lnw[target, level] = ln g - E/kT
+        lnw = lng[numpy.newaxis, :] - numpy.outer(1.0/kt, e)
+        lnwmax = numpy.max(lnw, axis=1)
+        w = numpy.exp(lnw - lnwmax[:, numpy.newaxis])
+        z = numpy.sum(w, axis=1)
+
+        e1 = numpy.dot(w, e)/z
+        e2 = numpy.dot(w, e*e)/z
+        lnz = lnwmax + numpy.log(z)
+
+        cv = util.nvt_cv(e1, e2, kt, volume)
+        f = -kt*lnz/volume
+
+        return e1/volume, cv, f
+
+
+    def internal_energy(self, kt, j=1.0):
+
+        """Return exact <E> per site at temperature(s) kt"""
+
+        e, _, _ = self.thermodynamics(kt, j)
+
+        return e
+
+
+    def heat_capacity(self, kt, j=1.0):
+
+        """Return exact specific heat capacity per site at kt"""
+
+        _, cv, _ = self.thermodynamics(kt, j)
+
+        return cv
+
+
+    def free_energy(self, kt, j=1.0):
+
+        """Return exact free energy per site at temperature(s) kt"""
+
+        _, _, f = self.thermodynamics(kt, j)
+
+        return f
+
+
+    @staticmethod
+    def _load(filename):
+
+        """Return cached content, or None if there is none"""
+
+        if not os.path.isfile(filename):
+            return None
+
+        with open(filename, "r") as f:
+            dos = json.load(f)
+
+        return dos
+
+
+    @staticmethod
+    def _save(filename, dos):
+
+        """Write content to the cache"""
+
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(filename, "w") as f:
+            json.dump(dos, f)
+
+
+def density_of_states(nlen, directory=DEFAULT_DIRECTORY):
+
+    """A convenience method to return the exact density of states"""
+
+    return IsingDensityOfStates(nlen, directory)
+
+
+# Fixed point arithmetic. A real number x is held as the integer
+# x*2^prec; a complex number as a tuple of two such integers.
+
+def _mul(a, b, prec):
+
+    return (a*b) >> prec
+
+
+def _divk(a, k):
+
+    # Truncate towards zero, so that the Taylor series terminates
+    if a < 0:
+        return -((-a)//k)
+    return a//k
+
+
+def _cmul(a, b, prec):
+
+    return ((a[0]*b[0] - a[1]*b[1]) >> prec, (a[0]*b[1] + a[1]*b[0]) >> prec)
+
+
+def _cdiv(a, b, prec):
+
+    d = b[0]*b[0] + b[1]*b[1]
+    re = ((a[0]*b[0] + a[1]*b[1]) << prec)//d
+    im = ((a[1]*b[0] - a[0]*b[1]) << prec)//d
+
+    return (re, im)
+
+
+def _cadd(a, b):
+
+    return (a[0] + b[0], a[1] + b[1])
+
+
+def _csub(a, b):
+
+    return (a[0] - b[0], a[1] - b[1])
+
+
+def _cpow(a, n, prec):
+
+    one = 1 << prec
+    result = (one, 0)
+    while n > 0:
+        if n & 1:
+            result = _cmul(result, a, prec)
+        a = _cmul(a, a, prec)
+        n >>= 1
+
+    return result
+
+
+def _pi(prec):
+
+    """pi to prec bits via Machin's formula"""
+
+    def arctan_inverse(x):
+        total = 0
+        term = (1 << prec)//x
+        n = 1
+        sign = 1
+        while term:
+            total += sign*(term//n)
+            term //= x*x
+            n += 2
+            sign = -sign
+        return total
+
+    return 16*arctan_inverse(5) - 4*arctan_inverse(239)
+
+
+def _expi(theta, prec):
+
+    """exp(i theta) by Taylor series; theta is fixed point"""
+
+    re = 0
+    im = 0
+    tr = 1 << prec
+    ti = 0
+    k = 0
+    while abs(tr) + abs(ti) > 1:
+        re += tr
+        im += ti
+        k += 1
+        tr, ti = _divk(-_mul(ti, theta, prec), k), _divk(_mul(tr, theta, prec), k)
+
+    return (re, im)
+
+
+def _partition_function(z, nlen, cosk, prec):
+
+    """Kaufman's Z for periodic nlen x nlen lattice with z = exp(2K)
+
+    Z = (1/2) (2 sinh 2K)^(N/2) (Z_1 + Z_2 + Z_3 + Z_4)
+
+    The factors for lattice indices k and 2n - k are equal, and are
+    combined so that only polynomials in cosh(gamma_k) appear:
+    (2 cosh(m gamma/2))^2 = 2 + 2 T_m(cosh gamma), and similarly for
+    sinh, where T_m is the Chebyshev polynomial. One factor of
+    d^m with d = 2 sinh 2K = z - 1/z is then taken into each term
+    of the product, so that nothing is singular at z = +/-1 (the
+    cases k = 0 and k = n reduce to polynomials in z and 1/z).
+    """
+
+    one = 1 << prec
+    m = nlen
+    zinv = (z[0], -z[1])
+    zp = _cadd(z, zinv)
+    d = _csub(z, zinv)
+    dm = _cpow(d, m, prec)
+
+    # d cosh(2K) coth(2K) = (z + 1/z)^2/2
+    da = _cmul(zp, zp, prec)
+    da = (da[0] >> 1, da[1] >> 1)
+    dd = _cmul(d, d, prec)
+
+    z1 = (one, 0)
+    z2 = (one, 0)
+    z3 = (one, 0)
+    z4 = (one, 0)
+
+    for k in range(1, nlen):
+
+        # u_k = d^k T_k(c) with c = cosh(gamma_k)
+        dc = (da[0] - _mul(cosk[k], d[0], prec),
+              da[1] - _mul(cosk[k], d[1], prec))
+        u0 = (one, 0)
+        u1 = dc
+        for _ in range(m - 1):
+            t1 = _cmul(dc, u1, prec)
+            t0 = _cmul(dd, u0, prec)
+            u0, u1 = u1, (2*t1[0] - t0[0], 2*t1[1] - t0[1])
+        fc = (2*u1[0] + 2*dm[0], 2*u1[1] + 2*dm[1])
+        fs = (2*u1[0] - 2*dm[0], 2*u1[1] - 2*dm[1])
+        if k % 2:
+            z1 = _cmul(z1, fc, prec)
+            z2 = _cmul(z2, fs, prec)
+        else:
+            z3 = _cmul(z3, fc, prec)
+            z4 = _cmul(z4, fs, prec)
+
+    # k = 0 and k = n: exp(gamma_0) = z tanh K, exp(gamma_n) = z/tanh K
+    # whence d^(m/2) 2 cosh(m gamma_0/2) = (z - 1)^m + (1 + 1/z)^m etc.
+
+    a0 = _cpow((z[0] - one, z[1]), m, prec)
+    a1 = _cpow((one + zinv[0], zinv[1]), m, prec)
+    an0 = _cpow((z[0] + one, z[1]), m, prec)
+    an1 = _cpow((one - zinv[0], -zinv[1]), m, prec)
+
+    z3 = _cmul(z3, _cmul(_cadd(a0, a1), _cadd(an0, an1), prec), prec)
+    z4 = _cmul(z4, _cmul(_csub(a0, a1), _csub(an0, an1), prec), prec)
+
+    total = _cadd(_cadd(z1, z2), _cadd(z3, z4))
+
+    return (total[0] >> 1, total[1] >> 1)
+
+
+def _coefficients(nlen, prec):
+
+    """Return g(S) (as a list of integers) at given precision, or None
+    if the rounding checks fail.
+
+    Z = sum_j g_j z^(N - 2j) with N = nlen^2 and S = 2N - 4j.
+    With z_q = exp(i pi q/M) for M = N + 1, the g_j follow from a
+    discrete Fourier transform of Z(z_q).
+    """
+
+    nspin = nlen*nlen
+    nfreq = nspin + 1
+    pi = _pi(prec)
+
+    cosk = [_expi((pi*k)//nlen, prec)[0] for k in range(nlen)]
+
+    # exp(i pi/M) and its powers
+
+    w2 = _expi(pi//nfreq, prec)
+
+    zq = [None]*nfreq
+    z = (1 << prec, 0)
+    for q in range(nfreq):
+        zq[q] = z
+        z = _cmul(z, w2, prec)
+
+    # Z(z_(M-q)) is the conjugate of Z(z_q) as the g_j are real.
+    # The transform requires only a few bits below the binary point
+    # of Z, while the twiddle factors must be good relative to Z
+    # itself (which is at most 2^N).
+
+    fbits = 16 + nfreq.bit_length()
+    tbits = min(prec, nspin + 2*fbits)
+
+    values = [None]*nfreq
+    for q in range(nfreq//2 + 1):
+        zpart = _partition_function(zq[q], nlen, cosk, prec)
+        zpart = (zpart[0] >> (prec - fbits), zpart[1] >> (prec - fbits))
+        values[q] = zpart
+        values[(nfreq - q) % nfreq] = (zpart[0], -zpart[1])
+
+    # exp(-2 pi i t/M) for t = 0, ..., M - 1
+
+    w = _cmul(w2, w2, prec)
+    w = (w[0], -w[1])
+    twiddle = []
+    z = (1 << prec, 0)
+    for _ in range(nfreq):
+        twiddle.append((z[0] >> (prec - tbits), z[1] >> (prec - tbits)))
+        z = _cmul(z, w, prec)
+
+    # g_j for S = 2N - 4j; a = N/2 - j. The symmetry g(S) = g(-S)
+    # means only a >= 0 is required.
+
+    g = [0]*nfreq
+    scale = fbits + tbits
+    half = 1 << (scale - 1)
+    tolerance = 1 << (scale - 2)
+
+    for a in range(nspin//2 + 1):
+        re = 0
+        im = 0
+        for q in range(nfreq):
+            t = twiddle[(a*q) % nfreq]
+            re += values[q][0]*t[0] - values[q][1]*t[1]
+            im += values[q][0]*t[1] + values[q][1]*t[0]
+        re //= nfreq
+        im //= nfreq
+        gint = (re + half) >> scale
+        if abs(re - (gint << scale)) > tolerance or abs(im) > tolerance:
+            return None
+        j = nspin//2 - a
+        g[j] = gint
+        g[nspin - j] = gint
+
+    if sum(g) != 2**nspin or min(g) < 0:
+        return None
+
+    return g
+
+
+def _density_of_states(nlen):
+
+    """Compute g(S) for the nlen x nlen periodic lattice
+
+    Returns:
+    dos (dict):   "nlen", "s" (list of S) and "g" (list of integer g(S))
+    """
+
+    nspin = nlen*nlen
+    prec = nspin + 64
+
+    while True:
+        g = _coefficients(nlen, prec)
+        if g is not None:
+            break
+        prec *= 2
+
+    s = [2*nspin - 4*j for j in range(nspin + 1)]
+
+    return {"nlen": nlen, "s": s, "g": g}
@@ -0,0 +1,183 @@
+"""Per-sweep instrumentation for IsingModel runs
+
+An Instrument passed to IsingModel.run(..., instrument=...) is told
+about each phase of the run as it happens:
+
+  sweep        one MC sweep (with the number of accepted moves)
+  observables  computation of S, M at a report step
+  report       running averages and report file output
+  events       event-log output (if any)
+
+The wall time of each phase is accumulated, together with the
+acceptance rate per sweep and per stage of the run (equilibration,
+ie., the first ndiscard sweeps, and production), and a summary dict
+is available from summary() at the end of the run. A callback may
+be supplied to see each phase as it completes.
+
+If no instrument is given, run() does not time anything, so there
+is no overhead when instrumentation is not wanted.
+"""
+
+import time
+
+import numpy
+
+PHASES = ("sweep", "observables", "report", "events")
+STAGES = ("equilibration", "production")
+
+
+class Instrument(object):
+
+    """Accumulate timings and acceptance rates for a run"""
+
+    def __init__(self, per_sweep = True, callback = None,
+                 clock = time.perf_counter):
+
+        """
+        Arguments:
+        per_sweep (boolean)  -- keep the acceptance rate of each sweep
+        callback (callable)  -- called as callback(phase, n, seconds,
+                                naccept) after each phase of sweep n;
+                                naccept is None except for "sweep"
+        clock (callable)     -- timer returning seconds
+        """
+
+        self.per_sweep = per_sweep
+        self.callback = callback
+        self.clock = clock
+        self.start(1, 0)
+
+
+    def __repr__(self):
+
+        me = "nsweeps= {!r}, seconds= {!r}"\
+            .format(self.nsweeps, self.seconds["sweep"])
+
+        return "Instrument({!s})".format(me)
+
+
+    def start(self, nsite, ndiscard):
+
+        """Reset for a run of nsite spins discarding ndiscard sweeps"""
+
+        self.nsite = nsite
+        self.ndiscard = ndiscard
+        self.nsweeps = 0
+        self.seconds = dict((phase, 0.0) for phase in PHASES)
+        self.calls = dict((phase, 0) for phase in PHASES)
+        self.naccept = dict((stage, 0) for stage in STAGES)
+        self.nstage = dict((stage, 0) for stage in STAGES)
+        self._accepted = []
+        self._t0 = self.clock()
+        self._t1 = None
+
+
+    def stop(self):
+
+        """Record the end of the run"""
+
+        self._t1 = self.clock()
+
+
+    def sweep(self, n, naccept, seconds):
+
+        """Record sweep n with naccept accepted moves"""
+
+        stage = STAGES[0] if n <= self.ndiscard else STAGES[1]
+
+        self.nsweeps += 1
+        self.naccept[stage] += naccept
+        self.nstage[stage] += 1
+        self._add("sweep", seconds)
+
+        if self.per_sweep: self._accepted.append(naccept)
+        if self.callback is not None:
+            self.callback("sweep", n, seconds, naccept)
+
+
+    def observables(self, n, seconds):
+
+        """Record the computation of observables at sweep n"""
+
+        self._add("observables", seconds)
+        if self.callback is not None:
+            self.callback("observables", n, seconds, None)
+
+
+    def report(self, n, seconds):
+
+        """Record the report update at sweep n"""
+
+        self._add("report", seconds)
+        if self.callback is not None:
+            self.callback("report", n, seconds, None)
+
+
+    def events(self, n, seconds):
+
+        """Record event-log output at sweep n"""
+
+        self._add("events", seconds)
+        if self.callback is not None:
+            self.callback("events", n, seconds, None)
+
+
+    def acceptance(self):
+
+        """Return the acceptance rate of each sweep (numpy.ndarray)"""
+
+        return numpy.array(self._accepted, dtype = float)/self.nsite
+
+
+    def summary(self):
+
+        """
+        Returns:
+        summary (dict) -- 'nsweeps', 'nsite', 'seconds' (per phase,
+                          and 'total' wall time), 'fraction' (of
+                          total per phase), 'calls' (per phase),
+                          'flips_per_second' (attempted flips over
+                          sweep time), 'acceptance' (per stage and
+                          'overall'), and 'acceptance_per_sweep'
+                          (if per_sweep)
+        """
+
+        t1 = self.clock() if self._t1 is None else self._t1
+        total = t1 - self._t0
+
+        seconds = dict(self.seconds)
+        seconds["total"] = total
+
+        fraction = dict((phase, self.seconds[phase]/total if total > 0.0
+                         else 0.0) for phase in PHASES)
+        fraction["other"] = 1.0 - sum(fraction.values()) if total > 0.0 \
+            else 0.0
+
+        acceptance = {}
+        for stage in STAGES:
+            nflip = self.nstage[stage]*self.nsite
+            acceptance[stage] = self.naccept[stage]/nflip if nflip else None
+        nflip = self.nsweeps*self.nsite
+        acceptance["overall"] = \
+            sum(self.naccept.values())/nflip if nflip else None
+
+        tsweep = self.seconds["sweep"]
+
+        summary = {}
+        summary["nsweeps"] = self.nsweeps
+        summary["nsite"] = self.nsite
+        summary["seconds"] = seconds
+        summary["fraction"] = fraction
+        summary["calls"] = dict(self.calls)
+        summary["flips_per_second"] = nflip/tsweep if tsweep > 0.0 else None
+        summary["acceptance"] = acceptance
+        if self.per_sweep:
+            summary["acceptance_per_sweep"] = self.acceptance()
+
+        return summary
+
+
+    def _add(self, phase, seconds):
+
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
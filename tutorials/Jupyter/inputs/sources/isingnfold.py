@@ -0,0 +1,289 @@
+"""Rejection-free (n-fold way) kinetic Monte Carlo for IsingModel
+
+In the n-fold way (Bortz, Kalos and Lebowitz, J. Comput. Phys. 17,
+10 (1975)) each site is classified by its own spin and the sum of
+its four neighbours: there are ten classes, and all sites in a class
+have the same Metropolis flip probability p_c. Sites are held in one
+bin per class, so that an accepted flip is chosen directly:
+
+  1. choose class c with probability n_c p_c / R, R = sum n_c p_c;
+  2. choose a site uniformly from the bin for class c, and flip it;
+  3. move the site and its neighbours to their new bins;
+  4. advance the clock by an exponential waiting time of mean 1/R.
+
+The clock is in MC sweeps: a site of class c flips at rate p_c per
+sweep, as for random updates. At low temperature, where almost all
+Metropolis proposals are rejected, the cost per unit time is smaller
+by the acceptance rate.
+
+The engine works on the lattice of an IsingModel (call sync() to
+copy the current state back to IsingModel.s).
+"""
+
+import numpy
+
+from inputs.sources.ising import NEAREST_NEIGHBOUR
+
+NCLASS = 10
+
+
+class NFoldWay(object):
+
+    """n-fold way engine for an IsingModel"""
+
+    def __init__(self, model, kT = None, nrandom = 4096):
+
+        """
+        Arguments:
+        model (IsingModel) -- provides the lattice, j and h
+        kT (float)         -- temperature (default model.kT)
+        nrandom (integer)  -- size of the block of random deviates
+                              drawn at once
+        """
+
+        if model.stencil != NEAREST_NEIGHBOUR:
+            raise ValueError("The n-fold way requires nearest neighbours")
+
+        self.model = model
+        self.nlen = model.nlen
+        self.j = model.j
+        self.h = model.h
+        self.time = 0.0
+        self.nevent = 0
+
+        nlen = self.nlen
+        nsite = nlen*nlen
+
+        ic, jc = numpy.divmod(numpy.arange(nsite), nlen)
+        nbrs = numpy.array([numpy.mod(ic - 1, nlen)*nlen + jc,
+                            numpy.mod(ic + 1, nlen)*nlen + jc,
+                            ic*nlen + numpy.mod(jc - 1, nlen),
+                            ic*nlen + numpy.mod(jc + 1, nlen)]).T
+
+        self._nbrs = [tuple(n) for n in nbrs.tolist()]
+        self._spin = model.s.reshape(-1).tolist()
+
+        # Bins: sites of each class, with the position of each site
+        self._bins = [[] for _ in range(NCLASS)]
+        self._class = [0]*nsite
+        self._where = [0]*nsite
+
+        for x in range(nsite):
+            c = self._classify(x)
+            self._class[x] = c
+            self._where[x] = len(self._bins[c])
+            self._bins[c].append(x)
+
+        self._stot = sum(self._spin[x]*(self._spin[n[1]] + self._spin[n[3]])
+                         for x, n in enumerate(self._nbrs))
+        self._mtot = sum(self._spin)
+
+        self._nrandom = nrandom
+        self._random = []
+
+        self.set_temperature(model.kT if kT is None else kT)
+
+
+    def __repr__(self):
+
+        me = "nlen= {!r}, kT= {!r}, time= {!r}, nevent= {!r}"\
+            .format(self.nlen, self.kT, self.time, self.nevent)
+
+        return "NFoldWay({!s})".format(me)
+
+
+    def set_temperature(self, kT):
+
+        """Set the temperature (the bins do not change)"""
+
+        self.kT = kT
+        self.rate = []
+
+        for c in range(NCLASS):
+            s0, nbr = _class_state(c)
+            delta = 2.0*s0*(self.j*nbr + self.h)
+            self.rate.append(numpy.exp(-max(delta, 0.0)/kT))
+
+
+    def counts(self):
+
+        """Return the number of sites in each class"""
+
+        return [len(b) for b in self._bins]
+
+
+    def total_rate(self):
+
+        """Return R, the total flip rate (per sweep)"""
+
+        return sum(len(b)*r for b, r in zip(self._bins, self.rate))
+
+
+    def observables(self):
+
+        """Return current S, M per site (cf. IsingModel.observables)"""
+
+        nsite = 1.0*self.nlen*self.nlen
+
+        return [self._stot/nsite, self._mtot/nsite]
+
+
+    def sync(self):
+
+        """Copy the current state to the IsingModel lattice"""
+
+        self.model.s[:, :] = numpy.array(self._spin).reshape(self.nlen,
+                                                             self.nlen)
+
+
+    def advance(self, duration):
+
+        """
+        Advance the clock by duration (sweeps), performing all the
+        flips that occur in that time. The waiting time is memoryless,
+        so stopping at an arbitrary time is exact.
+
+        Returns:
+        nevent (integer)   -- number of flips performed
+        """
+
+        tend = self.time + duration
+        nevent = 0
+
+        while True:
+            r = self.total_rate()
+            if r <= 0.0:
+                break
+            dt = -numpy.log(1.0 - self._uniform())/r
+            if self.time + dt > tend:
+                break
+            self.time += dt
+            self._flip(self._choose(r))
+            nevent += 1
+
+        self.time = tend
+        self.nevent += nevent
+
+        return nevent
+
+
+    def run_iter(self, nsweeps, report_freq = 1):
+
+        """
+        Advance by nsweeps, yielding (time, S, M, nevent) every
+        report_freq sweeps (cf. IsingModel.run_iter). The lattice of
+        the IsingModel is synchronised at the end.
+        """
+
+        t = 0
+        while t < nsweeps:
+            dt = min(report_freq, nsweeps - t)
+            nevent = self.advance(dt)
+            t += dt
+            [s, m] = self.observables()
+            yield (self.time, s, m, nevent)
+
+        self.sync()
+
+
+    def step(self):
+
+        """Perform one flip, and return the waiting time (or None if
+        no flip is possible)"""
+
+        r = self.total_rate()
+        if r <= 0.0:
+            return None
+
+        dt = -numpy.log(1.0 - self._uniform())/r
+        self.time += dt
+        self._flip(self._choose(r))
+        self.nevent += 1
+
+        return dt
+
+
+    def _uniform(self):
+
+        if not self._random:
+            self._random = numpy.random.uniform(size = self._nrandom).tolist()
+
+        return self._random.pop()
+
+
+    def _choose(self, r):
+
+        """Return a site chosen with probability proportional to rate"""
+
+        target = r*self._uniform()
+        c = 0
+        for c in range(NCLASS):
+            w = len(self._bins[c])*self.rate[c]
+            if target < w:
+                break
+            target -= w
+
+        # Guard against round-off at the top of the range: use the
+        # last class with a non-zero total rate
+        while not (self._bins[c] and self.rate[c] > 0.0):
+            c -= 1
+
+        b = self._bins[c]
+        n = min(int(self._uniform()*len(b)), len(b) - 1)
+
+        return b[n]
+
+
+    def _flip(self, x):
+
+        spin = self._spin
+        nbrs = self._nbrs[x]
+
+        s0 = spin[x]
+        spin[x] = -s0
+        self._stot -= 2*s0*(spin[nbrs[0]] + spin[nbrs[1]] + spin[nbrs[2]]
+                            + spin[nbrs[3]])
+        self._mtot -= 2*s0
+
+        self._rebin(x)
+        for n in nbrs:
+            self._rebin(n)
+
+
+    def _rebin(self, x):
+
+        c = self._classify(x)
+        old = self._class[x]
+        if c == old:
+            return
+
+        # Remove from the old bin by swapping with its last entry
+        b = self._bins[old]
+        n = self._where[x]
+        last = b.pop()
+        if last != x:
+            b[n] = last
+            self._where[last] = n
+
+        self._class[x] = c
+        self._where[x] = len(self._bins[c])
+        self._bins[c].append(x)
+
+
+    def _classify(self, x):
+
+        spin = self._spin
+        n = self._nbrs[x]
+        nbr = spin[n[0]] + spin[n[1]] + spin[n[2]] + spin[n[3]]
+
+        return 5*((spin[x] + 1)//2) + (nbr + 4)//2
+
+
+def _class_state(c):
+
+    """Return (spin, sum of neighbours) for class c"""
+
+    s0 = 2*(c//5) - 1
+    nbr = 2*(c % 5) - 4
+
+    return s0, nbr
@@ -0,0 +1,35 @@
+"""Tests for inputs.sources.ising"""
+
+from inputs.sources.ising import IsingModel
+
+
+def test_run_adaptive_random_update():
+
+    """The random_update argument reaches the sweeps"""
+
+    summary = {}
+    for random_update in (False, True):
+        model = IsingModel(8, 1.0, 0.0, 2.3, 7)
+        summary[random_update] = \
+            model.run_adaptive(1.0e-6, nmin = 64, nmax = 64,
+                               random_update = random_update)
+
+    assert summary[False]["nsteps"] == summary[True]["nsteps"] == 64
+    assert summary[False]["mean"] != summary[True]["mean"]
+
+
+def test_run_instrumented_trajectory(tmp_path):
+
+    """Timing a run does not change its trajectory"""
+
+    reports = {}
+    for instrument in (None, True):
+        model = IsingModel(8, 1.0, 0.0, 2.3, 7)
+        name = str(tmp_path / "run{}.dat".format(instrument is not None))
+        summary = model.run(40, file = name, report_freq = 4, ndiscard = 8,
+                            instrument = instrument)
+        with open(name) as f: reports[instrument] = f.read()
+
+    assert reports[None] == reports[True]
+    assert summary["nsweeps"] == 40
+    assert summary["calls"]["report"] == 8
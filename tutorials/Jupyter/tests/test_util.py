@@ -0,0 +1,44 @@
+"""Tests for inputs.util"""
+
+import numpy
+
+import inputs.util as util
+
+
+def test_mbar_solve_separated_runs():
+
+    """Well separated low temperature runs converge to the fixed point"""
+
+    rng = numpy.random.default_rng(0)
+    kT = [0.5, 0.6, 0.7]
+    e = [numpy.round(rng.normal(mean, 30.0, 4000))
+         for mean in (-8150.0, -8100.0, -8000.0)]
+    w = [1.0, 1.0, 1.0]
+
+    f, info = util.multiple_free_energies_solve(e, kT, w)
+
+    assert info["converged"]
+    assert numpy.all(numpy.isfinite(f))
+
+    f0 = util.multiple_free_energies(e, kT, w, nmaxit = 2000)
+    assert numpy.allclose(f, f0 - f0[0], rtol = 0.0, atol = 1.0e-6)
+
+
+def test_candidate_inefficiency():
+
+    """Candidates from one transform agree with one FFT per candidate"""
+
+    rng = numpy.random.default_rng(1)
+    x = numpy.zeros((2, 3000))
+    z = rng.normal(size = x.shape)
+    for t in range(1, x.shape[1]):
+        x[:, t] = 0.9*x[:, t - 1] + z[:, t]
+    x[1] += 10.0*numpy.exp(-numpy.arange(x.shape[1])/200.0)
+
+    starts = numpy.arange(0, 1500, 15)
+    g, last = util._candidate_inefficiency(x, starts, 3)
+
+    for k, t0 in enumerate(starts):
+        gk, lastk = util._statistical_inefficiency(x[:, t0:], 3)
+        assert numpy.allclose(g[:, k], gk, rtol = 1.0e-10)
+        assert numpy.array_equal(last[:, k], lastk)